@@ -1,4 +1,4 @@
-{ stdenv, lib, version, openssl, datamash, pkg-config, coreutils, writeShellApplication, glibc, locales, tzdata, shadow, netcat, pythonWithPackages, rWithPackages, nushell, gawk }:
+{ stdenv, lib, version, openssl, datamash, pkg-config, coreutils, writeShellApplication, glibc, locales, tzdata, shadow, netcat, pythonWithPackages, rWithPackages, nushell, gawk, zstd }:
 
 writeShellApplication rec {
   name = "dst-data-container-setup";
@@ -18,6 +18,7 @@ writeShellApplication rec {
     shadow
     stdenv.shell
     tzdata
+    zstd
   ];
 
   text = ''
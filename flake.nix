@@ -27,7 +27,9 @@
         behave
         faker
         jinja2
+        numpy
         psycopg2
+        pyarrow
         pytest
         tabulate
       ]);
@@ -60,6 +62,7 @@
           packages."${system}".rWithPackages
           pkg-config
           plantuml
+          zstd
         ];
       };
     });
@@ -0,0 +1,58 @@
+#!/usr/bin/env bash
+
+set -euo pipefail
+
+INPUT_PATH="${1}"
+FRAME_BYTES="${2}"
+THREADS="${3}"
+
+if [[ ! -f "${INPUT_PATH}" ]]; then
+  echo "Argument 1 file path '${INPUT_PATH}' was not found";
+  exit 1
+fi
+
+OUTPUT_PATH="${INPUT_PATH}.zst"
+FRAMES_PATH="${INPUT_PATH%.csv}_frames.csv"
+TMP_DIR="${INPUT_PATH}.frames"
+
+rm -rf "${TMP_DIR}"
+mkdir -p "${TMP_DIR}"
+
+echo "[INFO] Compressing ${INPUT_PATH} in frames of ${FRAME_BYTES} bytes using ${THREADS} threads"
+
+# The file is split into frames of whole lines, which are compressed on their own, so a
+# byte range of the csv file can be read by only decompressing the frames it is in.
+# Concatenated zstd frames are a valid zstd file. split only counts the bytes of every
+# frame, the frames are then read from their offset in the file by parallel zstd
+# processes, so the uncompressed frames are never stored.
+split --line-bytes="${FRAME_BYTES}" --filter='wc -c' "${INPUT_PATH}" |
+  awk '{ printf "%d %.0f %.0f\n", NR, offset, $1; offset += $1 }' > "${TMP_DIR}/frames"
+
+export INPUT_PATH TMP_DIR
+
+xargs --no-run-if-empty -P "${THREADS}" -L 1 bash -c '
+  tail -c +"$(( ${2} + 1 ))" "${INPUT_PATH}" | head -c "${3}" | zstd -q -c > "${TMP_DIR}/${1}.zst"
+' frame < "${TMP_DIR}/frames"
+
+# The frames table has the offset and length of every frame in the csv file, and
+# in the compressed file. The compressed frames are appended to the output in order
+# and removed once they are appended.
+: > "${OUTPUT_PATH}.tmp"
+: > "${TMP_DIR}/lengths"
+
+while read -r index offset length; do
+  frame_path="${TMP_DIR}/${index}.zst"
+
+  echo "${length} $(wc -c < "${frame_path}")" >> "${TMP_DIR}/lengths"
+  cat "${frame_path}" >> "${OUTPUT_PATH}.tmp"
+  rm -f "${frame_path}"
+done < "${TMP_DIR}/frames"
+
+awk '
+  BEGIN { print "offset,length,compressed_offset,compressed_length" }
+  { printf "%.0f,%.0f,%.0f,%.0f\n", offset, $1, compressed_offset, $2; offset += $1; compressed_offset += $2 }
+' "${TMP_DIR}/lengths" > "${FRAMES_PATH}.tmp"
+
+mv -f "${OUTPUT_PATH}.tmp" "${OUTPUT_PATH}"
+mv -f "${FRAMES_PATH}.tmp" "${FRAMES_PATH}"
+rm -rf "${TMP_DIR}" "${INPUT_PATH}"
@@ -0,0 +1,85 @@
+# Reads the rows of a csv file, without its header, and writes every row prefixed with the
+# values of the columns at the positions in key_indexes, e.g. "1 3". The values are followed
+# by a unit separator each, and the row as it is written in the input by a NUL byte instead
+# of its line break, so that rows with quoted delimiters, doubled quotes or line breaks can
+# be sorted, partitioned and indexed by their keys like any other row. The quotes of quoted
+# values are removed, and a quoted value that is never closed is an error.
+#
+#   awk -v key_indexes="1 3" -f csv-keys.awk dataset.csv
+
+function csv_split(row, fields,    n, i, c, len, value, quoted) {
+  if (index(row, "\"") == 0) {
+    return split(row, fields, ",")
+  }
+
+  n      = 0
+  len    = length(row)
+  value  = ""
+  quoted = 0
+
+  for (i = 1; i <= len; i++) {
+    c = substr(row, i, 1)
+
+    if (quoted) {
+      if (c != "\"") {
+        value = value c
+      } else if (substr(row, i + 1, 1) == "\"") {
+        value = value "\""
+        i++
+      } else {
+        quoted = 0
+      }
+    } else if (c == "\"") {
+      quoted = 1
+    } else if (c == ",") {
+      fields[++n] = value
+      value       = ""
+    } else {
+      value = value c
+    }
+  }
+
+  fields[++n] = value
+
+  return n
+}
+
+BEGIN {
+  keys_count = split(key_indexes, keys, " ")
+}
+
+{
+  row = pending ? pending_row "\n" $0 : $0
+
+  # A row with an odd amount of quotes so far ends in a quoted value that continues on
+  # the next line
+  if (index(row, "\"") != 0) {
+    quotes = row
+
+    if (gsub(/"/, "", quotes) % 2 == 1) {
+      pending_row = row
+      pending     = 1
+      next
+    }
+  }
+
+  pending = 0
+
+  split("", fields)
+  csv_split(row, fields)
+
+  prefix = ""
+
+  for (i = 1; i <= keys_count; i++) {
+    prefix = prefix fields[keys[i]] "\037"
+  }
+
+  printf "%s%s%c", prefix, row, 0
+}
+
+END {
+  if (pending) {
+    print "Quoted value of the last row of " (FILENAME == "" || FILENAME == "-" ? "the input" : FILENAME) " is not closed" > "/dev/stderr"
+    exit 1
+  }
+}
@@ -0,0 +1,70 @@
+#!/usr/bin/env bash
+
+set -euo pipefail
+
+INPUT_PATH="${1}"
+KEY_COLUMN="${2}"
+OUTPUT_PATH="${3}"
+
+if [[ ! -f "${INPUT_PATH}" ]]; then
+  echo "Argument 1 file path '${INPUT_PATH}' was not found";
+  exit 1
+fi
+
+IFS="," read -r -a HEADER < <(head -n 1 "${INPUT_PATH}")
+
+KEY_INDEX=0
+
+for index in "${!HEADER[@]}"; do
+  if [[ "${HEADER[${index}]}" == "${KEY_COLUMN}" ]]; then
+    KEY_INDEX=$((index + 1))
+  fi
+done
+
+if [[ "${KEY_INDEX}" == 0 ]]; then
+  echo "Column '${KEY_COLUMN}' was not found in '${INPUT_PATH}'"
+  exit 1
+fi
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+HEADER_BYTES="$(head -n 1 "${INPUT_PATH}" | wc -c)"
+
+echo "[INFO] Indexing ${INPUT_PATH} by ${KEY_COLUMN} into ${OUTPUT_PATH}"
+
+# The input is sorted by the key, so every key is a single range of rows. Each range
+# is written as the key, the byte offset and length of its rows and the amount of rows.
+# The rows are read as csv, see csv-keys.awk, so rows with quoted line breaks are counted
+# as one row. Keys are compared as strings, since IDs that only differ by leading zeros
+# are different keys.
+tail -n +2 "${INPUT_PATH}" \
+  | LC_ALL=C awk -v key_indexes="${KEY_INDEX}" -f "${SCRIPT_DIR}/csv-keys.awk" \
+  | LC_ALL=C awk -v key_column="${KEY_COLUMN}" -v offset="${HEADER_BYTES}" '
+    BEGIN {
+      RS = "\0"
+      print key_column ",offset,length,rows"
+    }
+    {
+      separator = index($0, "\037")
+      row_key   = substr($0, 1, separator - 1)
+    }
+    NR == 1 || (row_key "") != (key "") {
+      if (NR > 1) {
+        print key "," start "," (offset - start) "," rows
+      }
+
+      key   = row_key
+      start = offset
+      rows  = 0
+    }
+    {
+      rows   += 1
+      offset += length($0) - separator + 1
+    }
+    END {
+      if (NR > 0) {
+        print key "," start "," (offset - start) "," rows
+      }
+    }
+  ' > "${OUTPUT_PATH}.tmp"
+
+mv -f "${OUTPUT_PATH}.tmp" "${OUTPUT_PATH}"
@@ -0,0 +1,84 @@
+#!/usr/bin/env bash
+
+set -euo pipefail
+
+INPUT_PATH="${1}"
+KEY_COLUMN="${2}"
+PARTITION_NAME="${3}"
+KEY_CHARS="${4}"
+OUTPUT_DIR="${5}"
+MANIFEST_PATH="${6}"
+
+if [[ ! -f "${INPUT_PATH}" ]]; then
+  echo "Argument 1 file path '${INPUT_PATH}' was not found";
+  exit 1
+fi
+
+IFS="," read -r -a HEADER < <(head -n 1 "${INPUT_PATH}")
+
+KEY_INDEX=0
+
+for index in "${!HEADER[@]}"; do
+  if [[ "${HEADER[${index}]}" == "${KEY_COLUMN}" ]]; then
+    KEY_INDEX=$((index + 1))
+  fi
+done
+
+if [[ "${KEY_INDEX}" == 0 ]]; then
+  echo "Column '${KEY_COLUMN}' was not found in '${INPUT_PATH}'"
+  exit 1
+fi
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+FILE_NAME="$(basename "${INPUT_PATH}")"
+
+rm -rf "${OUTPUT_DIR}"
+mkdir -p "${OUTPUT_DIR}"
+
+echo "[INFO] Partitioning ${INPUT_PATH} by ${PARTITION_NAME} into ${OUTPUT_DIR}"
+
+# Every row is appended to OUTPUT_DIR/PARTITION_NAME=VALUE/FILE_NAME, where the value is
+# the key column, or its first KEY_CHARS characters. The rows are read as csv, see
+# csv-keys.awk, so quoted delimiters and line breaks neither change the key of a row nor
+# split it. Rows without a value go to the partition Hive uses for them. The manifest has
+# the value and amount of rows of every partition.
+tail -n +2 "${INPUT_PATH}" \
+  | LC_ALL=C awk -v key_indexes="${KEY_INDEX}" -f "${SCRIPT_DIR}/csv-keys.awk" \
+  | LC_ALL=C awk \
+    -v header="$(head -n 1 "${INPUT_PATH}")" \
+    -v key_chars="${KEY_CHARS}" \
+    -v partition_name="${PARTITION_NAME}" \
+    -v output_dir="${OUTPUT_DIR}" \
+    -v file_name="${FILE_NAME}" '
+    BEGIN {
+      RS = "\0"
+    }
+    {
+      separator = index($0, "\037")
+      key       = substr($0, 1, separator - 1)
+      value     = key_chars > 0 ? substr(key, 1, key_chars) : key
+
+      if (value == "") {
+        value = "__HIVE_DEFAULT_PARTITION__"
+      }
+
+      if (!(value in rows)) {
+        dir = output_dir "/" partition_name "=" value
+        system("mkdir -p \"" dir "\"")
+
+        paths[value] = dir "/" file_name
+        print header > paths[value]
+      }
+
+      print substr($0, separator + 1) > paths[value]
+      rows[value] += 1
+    }
+    END {
+      for (value in rows) {
+        close(paths[value])
+        print value "," rows[value]
+      }
+    }
+  ' | LC_ALL=C sort > "${MANIFEST_PATH}.tmp"
+
+mv -f "${MANIFEST_PATH}.tmp" "${MANIFEST_PATH}"
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+"""
+Profiles the columns of a curated dataset in a single pass over its files, and
+writes the profile into its metadata. The files are read in chunks of rows, so
+memory usage does not grow with the size of the dataset.
+
+Every column in the metadata gets a "profile" with its amount of values and
+empty values, its smallest and largest value, compared as numbers for integer
+and number columns, an estimate of its amount of distinct values and its most
+common values. The "size" of the metadata is set to the amount of rows, and the
+placeholders {first_year} and {last_year} in its description are replaced by
+the smallest value of --first_column and the largest value of --last_column.
+
+Values that do not match the type, format or enum of their column are counted
+as invalid. With --strict the invalid values are reported and the script fails
+instead of writing the metadata.
+"""
+
+import argparse
+import csv
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import sys
+
+from collections import Counter
+
+#-------------------------------------------------------------------------------
+# Constants
+
+SCRIPT_NAME = "profile-dataset"
+
+# Amount of rows that are counted at a time
+CHUNK_SIZE = 100000
+
+# Amount of most common values in the profile of each column
+TOP_VALUES = 5
+
+# Amount of values that are counted to find the most common values. Values outside
+# of the most common ones are dropped once twice as many are counted, so the counts
+# are lower bounds of the real counts when a column has more distinct values.
+TOP_CAPACITY = 1000
+
+# HyperLogLog precision, with 2^12 registers the distinct counts are within about 1.6%
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_BITS      = 64 - HLL_PRECISION
+
+NUMERIC_TYPES = ["integer", "number"]
+
+# Amount of invalid values of each column that are kept as examples
+INVALID_EXAMPLES = 5
+
+TYPE_PATTERNS = {
+  "integer": re.compile(r"-?[0-9]+"),
+  "number": re.compile(r"-?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?")
+}
+
+# Values that are missing, readr writes missing values as NA and data.table as empty values
+NULL_VALUES = ["", "NA"]
+
+#-------------------------------------------------------------------------------
+# Logger setup
+
+logger = logging.getLogger(SCRIPT_NAME)
+logger.setLevel(logging.DEBUG)
+
+basic_formatter = logging.Formatter(
+  "[%(levelname)s] %(message)s"
+)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+
+stream_handler.setFormatter(basic_formatter)
+logger.addHandler(stream_handler)
+
+#-------------------------------------------------------------------------------
+# Column profiles
+
+def column_validator(column):
+  """
+  Returns a function that tells whether a value matches the type, format and
+  enum of a column in the metadata.
+  """
+  patterns = [re.compile(pattern) for pattern in [column.get("format")] if pattern is not None]
+
+  if column.get("type") in TYPE_PATTERNS:
+    patterns.append(TYPE_PATTERNS[column["type"]])
+
+  values = None if "enum" not in column else set(str(option["value"]) for option in column["enum"])
+
+  def validate(value):
+    return all(pattern.fullmatch(value) for pattern in patterns) and (values is None or value in values)
+
+  return validate
+
+def numeric_key(value):
+  try:
+    return (0, float(value), value)
+  except ValueError:
+    return (1, 0.0, value)
+
+class ColumnProfile:
+  def __init__(self, column):
+    self.key       = numeric_key if column.get("type") in NUMERIC_TYPES else None
+    self.validate  = column_validator(column)
+    self.count     = 0
+    self.nulls     = 0
+    self.invalid   = 0
+    self.examples  = []
+    self.min       = None
+    self.max       = None
+    self.registers = bytearray(HLL_REGISTERS)
+    self.top       = Counter()
+
+  def update(self, values):
+    counts = Counter(values)
+    nulls  = sum(counts.pop(value, 0) for value in NULL_VALUES)
+
+    self.count += len(values) - nulls
+    self.nulls += nulls
+
+    if not counts:
+      return
+
+    # Every statistic only needs the distinct values of the chunk
+    chunk_min = min(counts, key=self.key)
+    chunk_max = max(counts, key=self.key)
+
+    self.min = chunk_min if self.min is None else min(self.min, chunk_min, key=self.key)
+    self.max = chunk_max if self.max is None else max(self.max, chunk_max, key=self.key)
+
+    for value in counts:
+      digest   = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+      register = digest >> HLL_BITS
+      rank     = HLL_BITS - (digest & ((1 << HLL_BITS) - 1)).bit_length() + 1
+
+      if rank > self.registers[register]:
+        self.registers[register] = rank
+
+    for value in counts:
+      if not self.validate(value):
+        self.invalid += counts[value]
+
+        if len(self.examples) < INVALID_EXAMPLES and value not in self.examples:
+          self.examples.append(value)
+
+    self.top.update(counts)
+
+    if len(self.top) > 2 * TOP_CAPACITY:
+      self.top = Counter(dict(heapq.nlargest(TOP_CAPACITY, self.top.items(), key=lambda item: item[1])))
+
+  def distinct(self):
+    alpha    = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+    estimate = alpha * HLL_REGISTERS * HLL_REGISTERS / sum(2.0 ** -rank for rank in self.registers)
+    zeros    = self.registers.count(0)
+
+    # Small cardinalities are estimated from the amount of empty registers instead
+    if estimate <= 2.5 * HLL_REGISTERS and zeros > 0:
+      estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+
+    return round(estimate)
+
+  def to_dict(self):
+    return {
+      "count": self.count,
+      "nulls": self.nulls,
+      "min": self.min,
+      "max": self.max,
+      "distinct": self.distinct(),
+      "invalid": self.invalid,
+      "top": [
+        { "value": value, "count": count }
+        for (value, count) in sorted(self.top.items(), key=lambda item: (-item[1], item[0]))[:TOP_VALUES]
+      ]
+    }
+
+def profile_files(dataset_paths, columns):
+  """
+  Returns the amount of rows in the dataset files and the profile of each of
+  the given columns, a dict of column name to its metadata.
+  """
+  profiles   = { name: ColumnProfile(column) for (name, column) in columns.items() }
+  rows_count = 0
+
+  for dataset_path in dataset_paths:
+    logger.info(f"Profiling {dataset_path}")
+
+    with open(dataset_path, "r", newline="") as f:
+      reader = csv.reader(f)
+      header = next(reader, [])
+
+      indexes = [(header.index(name), profiles[name]) for name in profiles if name in header]
+
+      while True:
+        chunk = list(itertools.islice(reader, CHUNK_SIZE))
+
+        if not chunk:
+          break
+
+        rows_count += len(chunk)
+
+        for (index, profile) in indexes:
+          profile.update([row[index] if index < len(row) else "" for row in chunk])
+
+  return (rows_count, profiles)
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+  with open(args.metadata_file, "r") as f:
+    metadata = json.load(f)
+
+  (rows_count, profiles) = profile_files(args.dataset_files, metadata["columns"])
+
+  invalid_columns = [(name, profile) for (name, profile) in profiles.items() if profile.invalid]
+
+  for (name, profile) in invalid_columns:
+    examples = ", ".join(repr(value) for value in profile.examples)
+
+    logger.log(
+      logging.ERROR if args.strict else logging.WARNING,
+      f"Column {name} has {profile.invalid} values that do not match its type, format or enum, e.g. {examples}"
+    )
+
+  if args.strict and invalid_columns:
+    logger.error(f"{len(invalid_columns)} columns of {args.metadata_file} have invalid values")
+    sys.exit(1)
+
+  metadata["size"] = rows_count
+
+  for (name, profile) in profiles.items():
+    metadata["columns"][name]["profile"] = profile.to_dict()
+
+  if args.first_column is not None:
+    metadata["description"] = metadata["description"].replace("{first_year}", str(profiles[args.first_column].min))
+
+  if args.last_column is not None:
+    metadata["description"] = metadata["description"].replace("{last_year}", str(profiles[args.last_column].max))
+
+  logger.info(f"Writing profile of {rows_count} rows to {args.metadata_file}")
+
+  tmp_path = f"{args.metadata_file}.tmp"
+
+  with open(tmp_path, "w") as f:
+    f.write(json.dumps(metadata))
+
+  os.replace(tmp_path, args.metadata_file)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(prog=SCRIPT_NAME)
+
+  parser.add_argument(
+    "--log_level",
+    type=str,
+    choices=["error", "info", "debug"],
+    help="Controls the log level, 'info' is default"
+  )
+
+  parser.add_argument(
+    "--metadata_file",
+    type=str,
+    required=True,
+    help="Metadata file of the dataset, which the profile is written into"
+  )
+
+  parser.add_argument(
+    "--first_column",
+    type=str,
+    help="Column whose smallest value replaces {first_year} in the description"
+  )
+
+  parser.add_argument(
+    "--last_column",
+    type=str,
+    help="Column whose largest value replaces {last_year} in the description"
+  )
+
+  parser.add_argument(
+    "--strict",
+    action="store_true",
+    help="Fails when any value does not match the type, format or enum of its column"
+  )
+
+  parser.add_argument(
+    "dataset_files",
+    type=str,
+    nargs="*",
+    help="Files of the dataset"
+  )
+
+  args = parser.parse_args()
+
+  if args.log_level == "debug":
+    stream_handler.setLevel(logging.DEBUG)
+  elif args.log_level == "error":
+    stream_handler.setLevel(logging.ERROR)
+
+  main(args)
@@ -0,0 +1,83 @@
+#!/usr/bin/env bash
+
+set -euo pipefail
+
+INPUT_PATH="${1}"
+COLUMNS="${2}"
+SOURCE_FILE="${3}"
+OUTPUT_PATH="${4}"
+
+if [[ ! -f "${INPUT_PATH}" ]]; then
+  echo "Argument 1 file path '${INPUT_PATH}' was not found";
+  exit 1
+fi
+
+# Stage 1 files that are compressed with zstd are decompressed while they are read
+read_input() {
+  if [[ "${INPUT_PATH}" == *.zst ]]; then
+    zstd --decompress --stdout --quiet "${INPUT_PATH}"
+  else
+    cat "${INPUT_PATH}"
+  fi
+}
+
+IFS="," read -r -a HEADER < <(read_input | head -n 1)
+IFS="," read -r -a SELECTED <<< "${COLUMNS}"
+
+KEY_INDEXES=""
+
+for column in "${SELECTED[@]}"; do
+  KEY_INDEX=0
+
+  for index in "${!HEADER[@]}"; do
+    if [[ "${HEADER[${index}]}" == "${column}" ]]; then
+      KEY_INDEX=$((index + 1))
+    fi
+  done
+
+  if [[ "${KEY_INDEX}" == 0 ]]; then
+    echo "Column '${column}' was not found in '${INPUT_PATH}'"
+    exit 1
+  fi
+
+  KEY_INDEXES="${KEY_INDEXES} ${KEY_INDEX}"
+done
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+echo "[INFO] Selecting ${COLUMNS} from ${INPUT_PATH} into ${OUTPUT_PATH}"
+
+# Every row is written as the values of the given columns, in their order, and the source
+# file, without a header. The rows are read as csv, see csv-keys.awk, so quoted delimiters
+# and line breaks stay in their value, and the values are kept as strings, so IDs keep
+# their leading zeros. Values are quoted again when they need to be. Empty lines are not
+# rows and are skipped.
+read_input \
+  | tail -n +2 \
+  | LC_ALL=C awk -v key_indexes="${KEY_INDEXES}" -f "${SCRIPT_DIR}/csv-keys.awk" \
+  | LC_ALL=C awk -v keys_count="${#SELECTED[@]}" -v source_file="${SOURCE_FILE}" '
+    function csv_value(value) {
+      if (value ~ /[",\n\r]/) {
+        gsub(/"/, "\"\"", value)
+        return "\"" value "\""
+      }
+
+      return value
+    }
+    BEGIN {
+      RS = "\0"
+      FS = "\037"
+    }
+    NF == keys_count + 1 && $NF == "" {
+      next
+    }
+    {
+      row = ""
+
+      for (i = 1; i <= keys_count; i++) {
+        row = row csv_value($i) ","
+      }
+
+      print row csv_value(source_file)
+    }
+  ' > "${OUTPUT_PATH}"
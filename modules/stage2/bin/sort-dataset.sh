@@ -0,0 +1,77 @@
+#!/usr/bin/env bash
+
+set -euo pipefail
+
+INPUT_PATH="${1}"
+SORT_COLUMNS="${2}"
+BUFFER_SIZE="${3}"
+THREADS="${4}"
+
+if [[ ! -f "${INPUT_PATH}" ]]; then
+  echo "Argument 1 file path '${INPUT_PATH}' was not found";
+  exit 1
+fi
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+# The sort keys are the positions of the columns in the header, which has no quoted fields
+KEY_INDEXES=()
+SORT_KEYS=()
+
+IFS="," read -r -a HEADER < <(head -n 1 "${INPUT_PATH}")
+IFS="," read -r -a COLUMNS <<< "${SORT_COLUMNS}"
+
+for column in "${COLUMNS[@]}"; do
+  found=0
+
+  for index in "${!HEADER[@]}"; do
+    if [[ "${HEADER[${index}]}" == "${column}" ]]; then
+      KEY_INDEXES+=("$((index + 1))")
+      SORT_KEYS+=("-k${#KEY_INDEXES[@]},${#KEY_INDEXES[@]}")
+      found=1
+    fi
+  done
+
+  if [[ "${found}" == 0 ]]; then
+    echo "Column '${column}' was not found in '${INPUT_PATH}'"
+    exit 1
+  fi
+done
+
+TMP_DIR="${INPUT_PATH}.sort"
+TMP_PATH="${INPUT_PATH}.sorted"
+
+rm -rf "${TMP_DIR}"
+mkdir -p "${TMP_DIR}"
+
+echo "[INFO] Sorting ${INPUT_PATH} by ${SORT_COLUMNS}"
+
+# Every row is prefixed with the values of the sort columns and terminated by a NUL byte,
+# see csv-keys.awk, so that quoted values with delimiters or line breaks sort like any
+# other. GNU sort is an external merge sort, it sorts runs of at most BUFFER_SIZE in memory,
+# spills them to TMP_DIR and merges them. Rows with equal keys keep their order. The
+# prefixes are removed again afterwards.
+{
+  head -n 1 "${INPUT_PATH}"
+  tail -n +2 "${INPUT_PATH}" \
+    | LC_ALL=C awk -v key_indexes="${KEY_INDEXES[*]}" -f "${SCRIPT_DIR}/csv-keys.awk" \
+    | LC_ALL=C sort --stable --zero-terminated -t $'\037' "${SORT_KEYS[@]}" \
+      --buffer-size="${BUFFER_SIZE}" \
+      --parallel="${THREADS}" \
+      --temporary-directory="${TMP_DIR}" \
+    | LC_ALL=C awk -v keys_count="${#KEY_INDEXES[@]}" '
+      BEGIN {
+        RS = "\0"
+      }
+      {
+        for (i = 1; i <= keys_count; i++) {
+          $0 = substr($0, index($0, "\037") + 1)
+        }
+
+        print
+      }
+    '
+} > "${TMP_PATH}"
+
+mv -f "${TMP_PATH}" "${INPUT_PATH}"
+rm -rf "${TMP_DIR}"
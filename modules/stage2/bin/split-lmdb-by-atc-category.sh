@@ -1,15 +0,0 @@
-#!/usr/bin/env bash
-
-set -euo pipefail
-
-INPUT_PATH="${1}"
-OUTPUT_PREFIX="${2}"
-
-if [[ ! -f "${INPUT_PATH}" ]]; then
-  echo "Argument 1 file path '${INPUT_PATH}' was not found";
-  exit 1
-fi
-
-echo "[INFO] Splitting lmdb file ${INPUT_PATH} into ${OUTPUT_PREFIX}"
-
-tail -n+2 "${INPUT_PATH}" | awk -F , '{ print >> "'${OUTPUT_PREFIX}'-"substr($2, 0, 1)".csv" }'
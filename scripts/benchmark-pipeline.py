@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+#-------------------------------------------------------------------------------
+# Constants
+
+SCRIPT_NAME     = "benchmark-pipeline"
+SCRIPT_PATH     = os.path.realpath(__file__)
+SCRIPT_DIR      = os.path.dirname(SCRIPT_PATH)
+PROJECT_DIR     = os.path.dirname(SCRIPT_DIR)
+RESULTS_VERSION = 1
+
+#-------------------------------------------------------------------------------
+# Logger setup
+
+logger = logging.getLogger(SCRIPT_NAME)
+logger.setLevel(logging.DEBUG)
+
+basic_formatter = logging.Formatter(
+  "[%(levelname)s] %(message)s"
+)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+
+stream_handler.setFormatter(basic_formatter)
+logger.addHandler(stream_handler)
+
+#-------------------------------------------------------------------------------
+# Process sampling
+
+def read_proc_file(pid, name):
+  try:
+    with open(f"/proc/{pid}/{name}", "rb") as f:
+      return f.read()
+  except (FileNotFoundError, ProcessLookupError, PermissionError):
+    return None
+
+def read_parent_pids():
+  """
+  Returns the parent pid of every running process.
+  """
+  parents = {}
+
+  for entry in os.listdir("/proc"):
+    if not entry.isdigit():
+      continue
+
+    stat = read_proc_file(entry, "stat")
+
+    if stat is None:
+      continue
+
+    # The command name in the second field can contain spaces and parentheses
+    fields = stat[stat.rindex(b")") + 2:].split()
+    parents[int(entry)] = int(fields[1])
+
+  return parents
+
+def read_memory_status(pid):
+  """
+  Returns the current and peak resident set size of a process in bytes.
+  """
+  status = read_proc_file(pid, "status")
+
+  if status is None:
+    return None
+
+  memory = { "VmRSS": 0, "VmHWM": 0 }
+
+  for line in status.splitlines():
+    (key, _, value) = line.decode().partition(":")
+
+    if key in memory:
+      memory[key] = int(value.split()[0]) * 1024
+
+  return (memory["VmRSS"], memory["VmHWM"])
+
+class ProcessSampler:
+  """
+  Samples the resident set size of a process and all of its descendants from
+  /proc at a fixed interval, until stopped.
+  """
+  def __init__(self, root_pid, interval):
+    self.root_pid  = root_pid
+    self.interval  = interval
+    self.processes = {}
+    self.root_rss  = []
+    self.stopped   = threading.Event()
+    self.thread    = threading.Thread(target=self.run, daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def stop(self):
+    self.stopped.set()
+    self.thread.join()
+
+  def run(self):
+    while not self.stopped.is_set():
+      self.sample()
+      self.stopped.wait(self.interval)
+
+  def sample(self):
+    now      = time.time_ns()
+    parents  = read_parent_pids()
+    children = {}
+
+    for (pid, parent_pid) in parents.items():
+      children.setdefault(parent_pid, []).append(pid)
+
+    pending = [self.root_pid]
+
+    while pending:
+      pid    = pending.pop()
+      memory = read_memory_status(pid)
+
+      pending += children.get(pid, [])
+
+      if memory is None:
+        continue
+
+      (rss, peak_rss) = memory
+
+      if pid == self.root_pid:
+        self.root_rss.append((now, rss))
+        continue
+
+      process = self.processes.get(pid)
+
+      if process is None:
+        cmdline = read_proc_file(pid, "cmdline") or b""
+        process = {
+          "args": cmdline.decode(errors="replace").split("\0"),
+          "first_seen": now,
+          "last_seen": now,
+          "peak_rss": 0
+        }
+
+        self.processes[pid] = process
+
+      process["last_seen"] = now
+      process["peak_rss"]  = max(process["peak_rss"], peak_rss)
+
+  def peak_rss(self, started_at, finished_at, path_prefix):
+    """
+    Returns the peak resident set size of the largest process that ran during
+    the given period with an argument starting with the path prefix. For steps
+    that run inside Nushell itself, the peak of the Nushell process during the
+    period is returned instead, which is shared with any concurrent steps.
+    """
+    peaks = [
+      process["peak_rss"] for process in self.processes.values()
+      if process["first_seen"] <= finished_at and process["last_seen"] >= started_at
+      and any(arg.startswith(path_prefix) for arg in process["args"])
+    ]
+
+    if not peaks:
+      peaks = [rss for (sampled_at, rss) in self.root_rss if started_at <= sampled_at <= finished_at]
+
+    return max(peaks) if peaks else None
+
+#-------------------------------------------------------------------------------
+# Benchmark runs
+
+def count_rows(file_path):
+  """
+  Returns the amount of rows in a CSV file, excluding the header. The file is
+  read as csv, so rows with quoted line breaks are counted once. Files that are
+  compressed with zstd are decompressed with the zstd command while they are read.
+  """
+  if file_path.endswith(".zst"):
+    proc = subprocess.Popen(["zstd", "--decompress", "--stdout", "--quiet", file_path], stdout=subprocess.PIPE)
+    f    = io.TextIOWrapper(proc.stdout, newline="")
+  else:
+    proc = None
+    f    = open(file_path, "r", newline="")
+
+  with f:
+    rows = sum(1 for _ in csv.reader(f))
+
+  if proc is not None and proc.wait() != 0:
+    raise RuntimeError(f"Failed to decompress {file_path}")
+
+  return max(rows - 1, 0)
+
+def fixtures_settings(args, profile, scale_factor):
+  """
+  Returns what the fixtures depend on, which is written next to them once they
+  have been generated, so that only fixtures of the same settings are reused.
+  """
+  with open(os.path.join(SCRIPT_DIR, "generate-test-data.py"), "rb") as f:
+    generator_sha256 = hashlib.sha256(f.read()).hexdigest()
+
+  return {
+    "profile": profile,
+    "scale_factor": scale_factor,
+    "random_seed": args.random_seed,
+    "generator_sha256": generator_sha256
+  }
+
+def generate_fixtures(args, profile, scale_factor, fixture_dir):
+  grund_dir     = os.path.join(fixture_dir, "grund")
+  external_dir  = os.path.join(fixture_dir, "external")
+  metadata_file = os.path.join(fixture_dir, "metadata.json")
+  settings_file = os.path.join(fixture_dir, "fixtures.json")
+  settings      = fixtures_settings(args, profile, scale_factor)
+
+  # The settings file is only written once the fixtures are complete
+  if args.reuse_fixtures and os.path.exists(settings_file):
+    with open(settings_file, "r") as f:
+      if json.load(f) == settings:
+        logger.info(f"Reusing fixtures in {fixture_dir}")
+        return (metadata_file, grund_dir, external_dir)
+
+    logger.info(f"Not reusing fixtures in {fixture_dir}, they were generated with other settings")
+
+  shutil.rmtree(fixture_dir, ignore_errors=True)
+
+  os.makedirs(grund_dir)
+  os.makedirs(external_dir)
+  shutil.copyfile(os.path.join(PROJECT_DIR, "metadata.json"), metadata_file)
+
+  logger.info(f"Generating fixtures of profile {profile} with scale factor {scale_factor} into {fixture_dir}")
+
+  subprocess.check_call([
+    sys.executable, os.path.join(SCRIPT_DIR, "generate-test-data.py"),
+    "--engine", "numpy",
+    "--profile", profile,
+    "--scale_factor", str(scale_factor),
+    "--random_seed", str(args.random_seed),
+    "--workers", str(args.generator_workers),
+    "--grund_data_dir", grund_dir,
+    "--external_data_dir", external_dir,
+    "--metadata_file", metadata_file
+  ], cwd=PROJECT_DIR)
+
+  # Only the sas7bdat files are read by the pipeline
+  for directory in [grund_dir, external_dir]:
+    for fname in os.listdir(directory):
+      if fname.endswith(".csv"):
+        os.remove(os.path.join(directory, fname))
+
+  with open(settings_file, "w") as f:
+    f.write(json.dumps(settings, indent=2))
+
+  return (metadata_file, grund_dir, external_dir)
+
+def read_events(events_dir):
+  """
+  Returns the events the pipeline wrote into the events directory, one file per
+  stage 1 file conversion and stage 2 dataset derivation.
+  """
+  events = []
+
+  for fname in sorted(os.listdir(events_dir)):
+    if fname.endswith(".json"):
+      with open(os.path.join(events_dir, fname), "r") as f:
+        events.append(json.load(f))
+
+  return events
+
+def step_output(event):
+  """
+  Returns the path prefix the processes of a step are started with, and the
+  CSV files the step created.
+  """
+  result = event["result"]
+
+  if event["stage"] == "stage1":
+    return (result["output_path"], [result["output_path"]])
+
+  prefix = result["metadata"][:-len("_metadata.json")]
+
+  if "datasets" in result:
+    return (prefix, result["datasets"])
+
+  return (prefix, [result["dataset"]])
+
+def summarise_steps(events, sampler):
+  input_rows = {}
+  steps      = []
+
+  # Stage 2 steps count their input rows from the stage 1 outputs
+  for event in sorted(events, key=lambda event: event["stage"]):
+    (prefix, output_paths) = step_output(event)
+
+    seconds = (event["finished_at"] - event["started_at"]) / 1e9
+
+    if event["stage"] == "stage1":
+      rows = count_rows(output_paths[0])
+      input_rows[output_paths[0]] = rows
+    else:
+      rows = sum(input_rows.get(input_path, 0) for input_path in event["input_paths"])
+
+    steps.append({
+      "stage": event["stage"],
+      "step": event["step"],
+      "wall_seconds": round(seconds, 3),
+      "rows": rows,
+      "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+      "peak_rss_bytes": sampler.peak_rss(event["started_at"], event["finished_at"], prefix)
+    })
+
+  return sorted(steps, key=lambda step: (step["stage"], step["step"]))
+
+def run_pipeline(args, profile, scale_factor):
+  run_dir     = os.path.join(args.work_dir, f"{profile}-{scale_factor}")
+  output_dir  = os.path.join(run_dir, "output")
+  events_dir  = os.path.join(run_dir, "events")
+
+  (metadata_file, grund_dir, external_dir) = generate_fixtures(
+    args, profile, scale_factor, os.path.join(run_dir, "fixtures")
+  )
+
+  shutil.rmtree(output_dir, ignore_errors=True)
+  os.makedirs(output_dir)
+
+  shutil.rmtree(events_dir, ignore_errors=True)
+  os.makedirs(events_dir)
+
+  env = dict(os.environ, DDC_BENCHMARK_DIR=events_dir)
+
+  if args.threads is not None:
+    env["DDC_THREADS"] = str(args.threads)
+
+  logger.info(f"Running main.nu on profile {profile} with scale factor {scale_factor}")
+
+  started_at = time.time_ns()
+
+  with open(os.path.join(run_dir, "main.log"), "w") as log_file:
+    process = subprocess.Popen(
+      ["nu", os.path.join(PROJECT_DIR, "main.nu"), metadata_file, grund_dir, external_dir, output_dir],
+      cwd=PROJECT_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+
+    sampler = ProcessSampler(process.pid, args.sample_interval)
+    sampler.start()
+
+    exit_code = process.wait()
+
+    sampler.stop()
+
+  seconds = (time.time_ns() - started_at) / 1e9
+
+  if exit_code != 0:
+    raise RuntimeError(f"main.nu failed with exit code {exit_code}, see {os.path.join(run_dir, 'main.log')}")
+
+  steps = summarise_steps(read_events(events_dir), sampler)
+
+  if not args.keep_outputs:
+    shutil.rmtree(output_dir)
+
+  return {
+    "profile": profile,
+    "scale_factor": scale_factor,
+    "wall_seconds": round(seconds, 3),
+    "peak_rss_bytes": max((rss for (_, rss) in sampler.root_rss), default=None),
+    "steps": steps
+  }
+
+#-------------------------------------------------------------------------------
+# Baseline comparison
+
+def compare_to_baseline(runs, baseline, tolerance, min_seconds):
+  """
+  Compares the wall time and peak RSS of every step to the same step in the
+  baseline. Steps that took less than min_seconds in the baseline are only
+  compared by peak RSS, since their wall time is mostly noise.
+  """
+  baseline_steps = {
+    (run["profile"], run["scale_factor"], step["stage"], step["step"]): step
+    for run in baseline["runs"] for step in run["steps"]
+  }
+
+  comparison = []
+
+  for run in runs:
+    for step in run["steps"]:
+      key       = (run["profile"], run["scale_factor"], step["stage"], step["step"])
+      base_step  = baseline_steps.get(key)
+
+      if base_step is None:
+        continue
+
+      entry = {
+        "profile": run["profile"],
+        "scale_factor": run["scale_factor"],
+        "stage": step["stage"],
+        "step": step["step"],
+        "wall_seconds_ratio": None,
+        "peak_rss_ratio": None,
+        "regressions": []
+      }
+
+      if base_step["wall_seconds"] >= min_seconds:
+        entry["wall_seconds_ratio"] = round(step["wall_seconds"] / base_step["wall_seconds"], 3)
+
+        if entry["wall_seconds_ratio"] > 1 + tolerance:
+          entry["regressions"].append("wall_seconds")
+
+      if step["peak_rss_bytes"] and base_step["peak_rss_bytes"]:
+        entry["peak_rss_ratio"] = round(step["peak_rss_bytes"] / base_step["peak_rss_bytes"], 3)
+
+        if entry["peak_rss_ratio"] > 1 + tolerance:
+          entry["regressions"].append("peak_rss_bytes")
+
+      comparison.append(entry)
+
+  return comparison
+
+#-------------------------------------------------------------------------------
+
+def parse_scale(scale):
+  (profile, _, scale_factor) = scale.partition(":")
+
+  return (profile, float(scale_factor or 1))
+
+def main(args):
+  os.makedirs(args.work_dir, exist_ok=True)
+
+  runs = [run_pipeline(args, *parse_scale(scale)) for scale in args.scales]
+
+  results = {
+    "version": RESULTS_VERSION,
+    "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    "cpu_count": os.cpu_count(),
+    "threads": args.threads,
+    "random_seed": args.random_seed,
+    "runs": runs
+  }
+
+  regressions = []
+
+  if args.baseline_file is not None:
+    logger.info(f"Comparing results to baseline {args.baseline_file}")
+
+    with open(args.baseline_file, "r") as f:
+      baseline = json.loads(f.read())
+
+    results["baseline_file"] = args.baseline_file
+    results["comparison"]    = compare_to_baseline(runs, baseline, args.tolerance, args.min_seconds)
+
+    regressions = [entry for entry in results["comparison"] if entry["regressions"]]
+
+  with open(args.output_file, "w") as f:
+    f.write(json.dumps(results, indent=2))
+
+  for run in runs:
+    logger.info(f"Profile {run['profile']} with scale factor {run['scale_factor']} took {run['wall_seconds']}s")
+
+    for step in run["steps"]:
+      logger.info(f"  {step['stage']} {step['step']}: {step['wall_seconds']}s, {step['rows_per_second']} rows/s, peak RSS {step['peak_rss_bytes']} bytes")
+
+  for entry in regressions:
+    logger.error(f"Regression in {entry['stage']} {entry['step']} of {entry['profile']}:{entry['scale_factor']}: {', '.join(entry['regressions'])}")
+
+  logger.info(f"Wrote results to {args.output_file}")
+
+  if regressions:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(prog=SCRIPT_NAME)
+
+  parser.add_argument(
+    "--log_level",
+    type=str,
+    choices=["error", "info", "debug"],
+    help="Controls the log level, 'info' is default"
+  )
+
+  parser.add_argument(
+    "--scales",
+    type=str,
+    nargs="+",
+    default=["small:1", "medium:0.1", "medium:1"],
+    help="What fixtures to benchmark, as PROFILE:SCALE_FACTOR of scripts/generate-test-data.py"
+  )
+
+  parser.add_argument(
+    "--work_dir",
+    type=str,
+    default=os.path.join(PROJECT_DIR, "tmp", "benchmark"),
+    help="Directory to write fixtures and pipeline outputs into"
+  )
+
+  parser.add_argument(
+    "--output_file",
+    type=str,
+    default="benchmark-results.json",
+    help="File to write the results into, which can be used as baseline of a later run"
+  )
+
+  parser.add_argument(
+    "--baseline_file",
+    type=str,
+    help="Results of an earlier run to compare with, the script exits with code 1 if any step regressed"
+  )
+
+  parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    help="How much slower or larger a step can get relative to the baseline before it is a regression, 0.2 is default"
+  )
+
+  parser.add_argument(
+    "--min_seconds",
+    type=float,
+    default=1.0,
+    help="Steps faster than this in the baseline are not compared by wall time, 1 second is default"
+  )
+
+  parser.add_argument(
+    "--threads",
+    type=int,
+    help="Amount of threads for the pipeline to use, passed on as DDC_THREADS"
+  )
+
+  parser.add_argument(
+    "--random_seed",
+    type=int,
+    default=1,
+    help="What seed to generate fixtures with, keep it fixed to compare with a baseline"
+  )
+
+  parser.add_argument(
+    "--generator_workers",
+    type=int,
+    default=os.cpu_count(),
+    help="Amount of processes to generate fixtures with"
+  )
+
+  parser.add_argument(
+    "--sample_interval",
+    type=float,
+    default=0.1,
+    help="Seconds between samples of the resident set size of the pipeline processes"
+  )
+
+  parser.add_argument(
+    "--reuse_fixtures",
+    action="store_true",
+    help="Reuse fixtures generated by an earlier run in the work directory, when they were generated completely with the same profile, scale factor, random seed and generator"
+  )
+
+  parser.add_argument(
+    "--keep_outputs",
+    action="store_true",
+    help="Keep the pipeline outputs in the work directory"
+  )
+
+  args = parser.parse_args()
+
+  if args.log_level == "debug":
+    stream_handler.setLevel(logging.DEBUG)
+  elif args.log_level == "error":
+    stream_handler.setLevel(logging.ERROR)
+
+  main(args)
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+
+"""
+Reads rows from the curated datasets of stage 2 without scanning whole files.
+
+Every curated dataset file that is sorted by a column has an index next to it,
+where "population.csv" has "population_index.csv". It has the byte range of the
+rows of every value of the column, sorted the same way as the dataset:
+
+  person_id,offset,length,rows
+
+Example usage:
+
+  import dst_datasets
+
+  rows = dst_datasets.lookup_persons("output/stage2", ["846315", "0077131291838"])
+
+Datasets that are partitioned list their partitions in the "partitions" of
+their metadata, so a lookup can skip the partitions it does not need:
+
+  rows = dst_datasets.lookup_persons("output/stage2", ["846315"], filters={"tax_year": ["2008"]})
+
+Whole datasets are read lazily with open_dataset, which uses the metadata to
+parse the values of every column by its type. Only the requested columns are
+parsed, and rows are filtered while the files are streamed in batches:
+
+  income = dst_datasets.open_dataset("output/stage2/income")
+
+  for batch in income.iter_batches(columns=["person_id", "income_sum"], filters=[("tax_year", "==", 2008)]):
+    ...
+
+Filters on a partition column skip the partitions that cannot match, and
+filters with "==" or "in" on the indexed column only read the rows of the
+given values.
+
+Datasets that are compressed with zstd, "population.csv.zst", are decompressed
+with the zstd command while they are read. Their indexes have the offsets of
+the uncompressed file, and "population_frames.csv" has the offsets of the
+frames the file is compressed in, so lookups only decompress the frames of the
+rows they read.
+
+Datasets that are stored as Parquet, "population.parquet", are read with
+pyarrow, only the requested columns a row group at a time. They have no
+indexes, so filters on the indexed column read the whole file.
+"""
+
+import argparse
+import bisect
+import csv
+import datetime
+import glob
+import io
+import itertools
+import json
+import logging
+import operator
+import os
+import subprocess
+
+#-------------------------------------------------------------------------------
+# Constants
+
+SCRIPT_NAME    = "dst-datasets"
+INDEX_SUFFIX   = "_index.csv"
+FRAMES_SUFFIX  = "_frames.csv"
+ZSTD_SUFFIX    = ".zst"
+PARQUET_SUFFIX = ".parquet"
+
+# File formats of the curated datasets that can be read, by their extension in the metadata
+EXTENSIONS = ["csv", "parquet"]
+
+# Below this amount of bytes the index is scanned line by line instead of bisected
+SCAN_BYTES = 4096
+
+# Amount of rows that are read and parsed at a time
+BATCH_SIZE = 100000
+
+# Values that are read as None, readr writes missing values as NA and data.table as empty values
+NULL_VALUES = ["", "NA"]
+
+DATE_FORMAT = "^[0-9]{4}-[0-9]{2}-[0-9]{2}$"
+
+FILTER_OPERATORS = {
+  "==": operator.eq,
+  "!=": operator.ne,
+  "<": operator.lt,
+  "<=": operator.le,
+  ">": operator.gt,
+  ">=": operator.ge,
+  "in": lambda value, values: value in values,
+  "not in": lambda value, values: value not in values
+}
+
+#-------------------------------------------------------------------------------
+# Logger setup
+
+logger = logging.getLogger(SCRIPT_NAME)
+logger.setLevel(logging.DEBUG)
+
+basic_formatter = logging.Formatter(
+  "[%(levelname)s] %(message)s"
+)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+
+stream_handler.setFormatter(basic_formatter)
+logger.addHandler(stream_handler)
+
+#-------------------------------------------------------------------------------
+# Dataset files
+
+def dataset_stem(dataset_path):
+  """
+  Returns the path of a dataset file without its .csv or .csv.zst extension.
+  """
+  if dataset_path.endswith(ZSTD_SUFFIX):
+    dataset_path = dataset_path[:-len(ZSTD_SUFFIX)]
+
+  return dataset_path[:-len(".csv")]
+
+def file_suffix(file_format):
+  """
+  Returns the suffix of the files of a dataset by its file format in the
+  metadata, e.g. ".csv" or ".csv.zst".
+  """
+  if file_format["extension"] == "csv" and file_format.get("compression") == "zstd":
+    return ".csv" + ZSTD_SUFFIX
+
+  return "." + file_format["extension"]
+
+class ZstdTextReader(io.TextIOWrapper):
+  """
+  Reads a zstd compressed file as text, which is decompressed by the zstd
+  command while it is read. The command is stopped when the file is closed.
+  """
+
+  def __init__(self, path):
+    self.proc = subprocess.Popen(["zstd", "--decompress", "--stdout", "--quiet", path], stdout=subprocess.PIPE)
+
+    super().__init__(self.proc.stdout, newline="")
+
+  def close(self):
+    self.proc.kill()
+
+    super().close()
+
+    self.proc.wait()
+
+def open_text(dataset_path):
+  """
+  Opens a dataset file as text, where zstd compressed files are decompressed
+  while they are read.
+  """
+  if dataset_path.endswith(ZSTD_SUFFIX):
+    return ZstdTextReader(dataset_path)
+
+  return open(dataset_path, "r", newline="")
+
+def read_parquet(dataset_path, columns):
+  """
+  Returns the given columns of a Parquet dataset file and an iterator of the
+  values of its rows, which are only read a row group at a time.
+  """
+  import pyarrow.parquet
+
+  parquet_file = pyarrow.parquet.ParquetFile(dataset_path)
+
+  def read():
+    with parquet_file:
+      for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE, columns=columns):
+        yield from zip(*[column.to_pylist() for column in batch.columns])
+
+  return (columns, read())
+
+def read_header(dataset_path):
+  with open_text(dataset_path) as f:
+    return next(csv.reader(f), [])
+
+def decompress(data):
+  return subprocess.run(["zstd", "--decompress", "--stdout", "--quiet"], input=data, stdout=subprocess.PIPE, check=True).stdout
+
+def read_bytes(dataset_path, ranges):
+  """
+  Yields the bytes of every (offset, length) range of a dataset file, in the
+  given order, where the offsets are in the uncompressed file. Of compressed
+  files only the frames that the ranges are in are read and decompressed.
+  """
+  if not dataset_path.endswith(ZSTD_SUFFIX):
+    with open(dataset_path, "rb") as f:
+      for (offset, length) in ranges:
+        f.seek(offset)
+
+        yield f.read(length)
+
+    return
+
+  with open(dataset_stem(dataset_path) + FRAMES_SUFFIX, "r") as f:
+    frames = [tuple(int(field) for field in line.split(",")) for line in f.readlines()[1:]]
+
+  starts     = [frame[0] for frame in frames]
+  span_start = 0
+  span       = b""
+
+  with open(dataset_path, "rb") as f:
+    for (offset, length) in ranges:
+      # Ranges of the same key are often in the frames that were decompressed last
+      if offset < span_start or offset + length > span_start + len(span):
+        first = frames[bisect.bisect_right(starts, offset) - 1]
+        last  = frames[bisect.bisect_right(starts, offset + length - 1) - 1]
+
+        f.seek(first[2])
+
+        span_start = first[0]
+        span       = decompress(f.read(last[2] + last[3] - first[2]))
+
+      yield span[offset - span_start:offset - span_start + length]
+
+#-------------------------------------------------------------------------------
+# Indexes
+
+def index_path(dataset_path):
+  return dataset_stem(dataset_path) + INDEX_SUFFIX
+
+def index_column(dataset_path):
+  """
+  Returns the column a dataset file is indexed by, or None when it has no index.
+  """
+  path = index_path(dataset_path)
+
+  if not os.path.isfile(path):
+    return None
+
+  with open(path, "r") as f:
+    return f.readline().split(",")[0]
+
+def search_index(f, key, start, end):
+  """
+  Returns the (offset, length, rows) of the key in an index file opened in
+  binary mode, where the entries are between the byte offsets start and end.
+  """
+  lo = start
+  hi = end
+
+  # lo is always the start of an entry after which the key can be, and hi the
+  # start of an entry that is not before the key, or the end of the file
+  while hi - lo > SCAN_BYTES:
+    mid = (lo + hi) // 2
+
+    f.seek(mid - 1)
+    f.readline()
+
+    entry_start = f.tell()
+
+    if entry_start >= hi:
+      break
+
+    entry = f.readline()
+
+    if entry.split(b",", 1)[0] < key:
+      lo = entry_start + len(entry)
+    else:
+      hi = entry_start
+
+  f.seek(lo)
+
+  while f.tell() < end:
+    fields    = f.readline().rstrip(b"\n").split(b",")
+    entry_key = fields[0]
+
+    if entry_key == key:
+      return tuple(int(field) for field in fields[1:4])
+
+    if entry_key > key:
+      break
+
+  return None
+
+def read_ranges(dataset_path, keys):
+  """
+  Returns the header of a dataset file and an iterator of the values of its
+  rows where the indexed column has one of the given keys. Every key costs a
+  bisection of the index and a single read of the dataset file.
+  """
+  ranges = []
+
+  with open(index_path(dataset_path), "rb") as f:
+    header_length = len(f.readline())
+    index_size    = os.fstat(f.fileno()).st_size
+
+    for key in sorted(set(keys)):
+      entry = search_index(f, key.encode(), header_length, index_size)
+
+      if entry is not None:
+        ranges.append(entry)
+
+  header = read_header(dataset_path)
+
+  def read():
+    # Reading the ranges in file order keeps the seeks going forward
+    for data in read_bytes(dataset_path, [(offset, length) for (offset, length, _) in sorted(ranges)]):
+      yield from csv.reader(io.StringIO(data.decode(), newline=""))
+
+  return (header, read())
+
+def lookup(dataset_path, keys):
+  """
+  Returns the rows of a dataset file, as dicts, where the indexed column has
+  one of the given keys.
+  """
+  (columns, rows) = read_ranges(dataset_path, keys)
+
+  return [dict(zip(columns, values)) for values in rows]
+
+#-------------------------------------------------------------------------------
+# Datasets
+
+def prune_partitions(partitions, filters):
+  """
+  Returns the partitions of a dataset that match the filters, a dict of
+  partition column to allowed values. Filters on columns the dataset is not
+  partitioned by do not prune anything.
+  """
+  return [
+    partition for partition in partitions
+    if all(partition[column] in values for (column, values) in filters.items() if column in partition)
+  ]
+
+def dataset_files(stage2_dir, datasets=None, filters=None):
+  """
+  Returns the files of every curated dataset, or only the given datasets, as a
+  dict of dataset name to file paths. A dataset can have multiple files, like
+  the prescriptions which has one per ATC category, or the yearly datasets
+  when they are partitioned by year. The files of partitioned datasets are
+  pruned by the filters, a dict of partition column to allowed values, e.g.
+  {"tax_year": ["2008"]}, without opening them.
+  """
+  results = {}
+
+  for metadata_path in sorted(glob.glob(os.path.join(stage2_dir, "*_metadata.json"))):
+    name = os.path.basename(metadata_path)[:-len("_metadata.json")]
+
+    if datasets is not None and name not in datasets:
+      continue
+
+    with open(metadata_path, "r") as f:
+      metadata = json.load(f)
+
+    if "partitions" in metadata:
+      partitions = prune_partitions(metadata["partitions"], filters or {})
+      paths      = [os.path.join(stage2_dir, partition["path"]) for partition in partitions]
+    else:
+      paths = glob.glob(os.path.join(stage2_dir, name + file_suffix(metadata["file_format"])))
+
+    results[name] = sorted(paths)
+
+  return results
+
+#-------------------------------------------------------------------------------
+# Reading
+
+def column_parser(name, column):
+  """
+  Returns a function that parses the values of a column by its type in the
+  metadata, integer and number columns as int and float, date columns as
+  datetime.date and other columns as str. Missing values are parsed as None.
+  Values that are read with a type, from typed Parquet files, are kept.
+  """
+  if column.get("type") == "integer":
+    parse = int
+  elif column.get("type") == "number":
+    parse = float
+  elif column.get("format") == DATE_FORMAT:
+    parse = datetime.date.fromisoformat
+  else:
+    return lambda value: None if value is None or value in NULL_VALUES else value
+
+  def parse_value(value):
+    if value is None or value in NULL_VALUES:
+      return None
+
+    if not isinstance(value, str):
+      return value
+
+    try:
+      return parse(value)
+    except ValueError:
+      raise ValueError(f"Value {value!r} of column {name} is not a valid {column.get('type')}") from None
+
+  return parse_value
+
+class Dataset:
+  """
+  A curated dataset, which is only read when its rows are iterated. Its files,
+  columns and their types are taken from its metadata.
+  """
+
+  def __init__(self, path):
+    self.dir  = os.path.dirname(path)
+    self.name = os.path.basename(path)
+
+    with open(f"{path}_metadata.json", "r") as f:
+      self.metadata = json.load(f)
+
+    if self.metadata["file_format"]["extension"] not in EXTENSIONS:
+      raise ValueError(f"Dataset {self.name} is stored as {self.metadata['file_format']['extension']}, which cannot be read")
+
+    self.size           = self.metadata["size"]
+    self.sorted_by      = self.metadata.get("sorted_by", [])
+    self.partitioned_by = self.metadata.get("partitioned_by", [])
+    self.columns        = sorted(self.metadata["columns"], key=lambda name: self.metadata["columns"][name]["index"])
+
+  def files(self, filters=None):
+    """
+    Returns the paths of the files of the dataset, without the partitions whose
+    values do not match the "==" and "in" filters on partition columns.
+    """
+    if "partitions" not in self.metadata:
+      return [os.path.join(self.dir, self.name + file_suffix(self.metadata["file_format"]))]
+
+    values = {}
+
+    for (column, op, value) in filters or []:
+      if column not in self.partitioned_by:
+        continue
+
+      if op == "==":
+        values[column] = [str(value)]
+      elif op == "in":
+        values[column] = [str(v) for v in value]
+
+    return [os.path.join(self.dir, partition["path"]) for partition in prune_partitions(self.metadata["partitions"], values)]
+
+  def iter_batches(self, columns=None, filters=None, batch_size=BATCH_SIZE):
+    """
+    Yields the rows of the dataset that match all filters, in batches of at most
+    batch_size rows, as a dict of column name to a list of its values. Only the
+    given columns, or all columns, are returned. Filters are (column, operator,
+    value) tuples, e.g. ("tax_year", "==", 2008) or ("atc_id", "in", ["N06AB06"]),
+    where the value has the type of the column. Missing values never match.
+    """
+    columns = list(columns or self.columns)
+    filters = list(filters or [])
+
+    for column in columns:
+      if column not in self.metadata["columns"]:
+        raise ValueError(f"Dataset {self.name} has no column {column}")
+
+    for (column, op, _) in filters:
+      if op not in FILTER_OPERATORS:
+        raise ValueError(f"Unknown filter operator {op}")
+
+      if column not in self.metadata["columns"] and column not in self.partitioned_by:
+        raise ValueError(f"Dataset {self.name} has no column {column}")
+
+    # Filters on partition columns that are not in the files only prune partitions
+    row_filters = [(column, FILTER_OPERATORS[op], value) for (column, op, value) in filters if column in self.metadata["columns"]]
+    parsed      = list(dict.fromkeys(columns + [column for (column, _, _) in row_filters]))
+    parsers     = { column: column_parser(column, self.metadata["columns"][column]) for column in parsed }
+
+    for dataset_path in self.files(filters):
+      (header, rows) = self.read_file(dataset_path, parsed, row_filters)
+
+      indexes = { column: header.index(column) for column in parsed }
+
+      while True:
+        chunk = list(itertools.islice(rows, batch_size))
+
+        if not chunk:
+          break
+
+        values = { column: [parsers[column](row[indexes[column]]) for row in chunk] for column in parsed }
+        keep   = [
+          i for i in range(len(chunk))
+          if all(values[column][i] is not None and op(values[column][i], value) for (column, op, value) in row_filters)
+        ]
+
+        if keep:
+          yield { column: [values[column][i] for i in keep] for column in columns }
+
+  def iter_rows(self, columns=None, filters=None):
+    """
+    Yields the rows of the dataset that match all filters as dicts, see iter_batches.
+    """
+    for batch in self.iter_batches(columns, filters):
+      names = list(batch)
+
+      for values in zip(*batch.values()):
+        yield dict(zip(names, values))
+
+  def read_file(self, dataset_path, columns, row_filters):
+    """
+    Returns the header of a dataset file and an iterator of the values of its
+    rows. When the file is indexed and filtered by its indexed column with
+    "==" or "in", only the rows of the given values are read. Of Parquet files
+    only the given columns are read.
+    """
+    if dataset_path.endswith(PARQUET_SUFFIX):
+      return read_parquet(dataset_path, columns)
+
+    column = index_column(dataset_path)
+
+    for (filter_column, op, value) in row_filters:
+      if filter_column != column:
+        continue
+
+      if op is FILTER_OPERATORS["=="]:
+        return read_ranges(dataset_path, [str(value)])
+
+      if op is FILTER_OPERATORS["in"]:
+        return read_ranges(dataset_path, [str(v) for v in value])
+
+    f = open_text(dataset_path)
+
+    reader = csv.reader(f)
+    header = next(reader, [])
+
+    def read():
+      with f:
+        yield from reader
+
+    return (header, read())
+
+def open_dataset(path):
+  """
+  Returns a lazy Dataset for the curated dataset at the path, which is the
+  path of its files without extension, e.g. "output/stage2/income".
+  """
+  return Dataset(path)
+
+def lookup_persons(stage2_dir, person_ids, datasets=None, filters=None):
+  """
+  Returns every row of the given persons in the curated datasets that are
+  indexed by person_id, as a dict of dataset name to rows.
+  """
+  results = {}
+
+  for (name, paths) in dataset_files(stage2_dir, datasets, filters).items():
+    indexed_paths = [path for path in paths if index_column(path) == "person_id"]
+
+    if not indexed_paths:
+      logger.debug(f"Skipping dataset {name}, it is not indexed by person_id")
+      continue
+
+    results[name] = [row for path in indexed_paths for row in lookup(path, person_ids)]
+
+  return results
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+  person_ids = list(args.person_ids)
+
+  if args.person_ids_file is not None:
+    with open(args.person_ids_file, "r") as f:
+      person_ids += [line.strip() for line in f if line.strip()]
+
+  filters = {}
+
+  for partition in args.partitions:
+    (column, value) = partition.split("=", 1)
+    filters.setdefault(column, []).append(value)
+
+  logger.info(f"Looking up {len(person_ids)} persons in {args.stage2_dir}")
+
+  results = lookup_persons(args.stage2_dir, person_ids, args.datasets, filters)
+
+  for (name, rows) in results.items():
+    logger.info(f"Found {len(rows)} rows in dataset {name}")
+
+  with open(args.output_file, "w") as f:
+    f.write(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(prog=SCRIPT_NAME)
+
+  parser.add_argument(
+    "--log_level",
+    type=str,
+    choices=["error", "info", "debug"],
+    help="Controls the log level, 'info' is default"
+  )
+
+  parser.add_argument(
+    "--stage2_dir",
+    type=str,
+    required=True,
+    help="Stage 2 output directory of the pipeline"
+  )
+
+  parser.add_argument(
+    "--person_ids",
+    type=str,
+    nargs="*",
+    default=[],
+    help="IDs of the persons to get the rows of"
+  )
+
+  parser.add_argument(
+    "--person_ids_file",
+    type=str,
+    help="File with the IDs of the persons to get the rows of, one per line"
+  )
+
+  parser.add_argument(
+    "--datasets",
+    type=str,
+    nargs="+",
+    help="What datasets to look in, all datasets indexed by person_id is default"
+  )
+
+  parser.add_argument(
+    "--partitions",
+    type=str,
+    nargs="+",
+    default=[],
+    help="Only look in the partitions with these values, e.g. 'tax_year=2008 tax_year=2009 atc=N', partitioned datasets are searched whole by default"
+  )
+
+  parser.add_argument(
+    "--output_file",
+    type=str,
+    default="/dev/stdout",
+    help="File to write the rows into as JSON, per dataset"
+  )
+
+  args = parser.parse_args()
+
+  if args.log_level == "debug":
+    stream_handler.setLevel(logging.DEBUG)
+  elif args.log_level == "error":
+    stream_handler.setLevel(logging.ERROR)
+
+  main(args)
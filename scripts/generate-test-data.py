@@ -6,11 +6,18 @@ import argparse
 import datetime
 import csv
 import json
+import hashlib
+import math
+import pickle
+import secrets
 import sys
+import tempfile
 from subprocess import check_call
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from dateutil.relativedelta import relativedelta
 
+import numpy as np
 from faker import Faker
 
 #-------------------------------------------------------------------------------
@@ -22,6 +29,131 @@ PROJECT_DIR = os.path.realpath(os.path.dirname(os.path.dirname(__file__)))
 
 C_DODSMAADE_VALUES = ["-", "0", "01", "02", "03", "04", "05", "06", "07", "08", "09", "1", "10", "2", "3", "4", "5", "6", "7", "8", "9", "99", ""]
 
+ATC_CATEGORIES = "ABCDGHJLMNPQRSV"
+
+# Share of the families of a year of a profile that are replaced by new families
+# in the next year. The families of every year are taken from one pool of
+# families, so that the same persons recur across years and datasets, like in
+# the registers.
+FAMILY_TURNOVER = 0.05
+
+# Persons and families are numbered in the order they have in the pool, and
+# their ids are their numbers scrambled by a multiplication modulo ID_SPACE.
+# The multipliers have no factor in common with ID_SPACE, so every number below
+# ID_SPACE gets a different id, of at most 10 digits like a CPR number.
+ID_SPACE             = 10 ** 10
+PERSON_ID_MULTIPLIER = 6364136223
+FAMILY_ID_MULTIPLIER = 2862933557
+
+# Datasets that are generated together, which are the unit of work when
+# generating in parallel
+YEARLY_GROUPS   = ["bef", "lmdb", "ind", "dodsaars", "dodsaasg", "faik", "udda", "ras", "akm", "lpr2", "lpr3", "psyk"]
+EXTERNAL_GROUPS = ["pcr_icd8", "pcr_icd10"]
+
+SMALL_FAN_OUT = {
+  "lmdb": { "min": 1, "max": 5 },
+  "patient_icd8": { "min": 1, "max": 5 },
+  "patient_icd10": { "min": 1, "max": 5 },
+  "diag_icd10": { "min": 0, "max": 2 },
+  "lpr_adm": { "min": 1, "max": 5 },
+  "lpr_diag": { "min": 0, "max": 2 },
+  "psyk_adm": { "min": 1, "max": 5 },
+  "psyk_diag": { "min": 0, "max": 2 },
+  "lpr_f_kontakter": { "min": 1, "max": 5 },
+  "lpr_f_diagnoser": { "min": 0, "max": 2 }
+}
+
+# Fixture size profiles. The fan-out of a dataset is the amount of rows per row
+# in its parent dataset (BEF, or the records for diagnoses), either uniform
+# between min and max, or negative binomial with the given mean, where a lower
+# dispersion means a more skewed distribution. The coverage limits which years
+# a dataset group exists in, like the registers in production.
+PROFILES = {
+  "small": {
+    "families": 10,
+    "chunk_size": 10000,
+    "years": [1985, 1993, 2008, 2020],
+    "coverage": {},
+    "fan_out": SMALL_FAN_OUT,
+    "atc_weights": None
+  },
+  "medium": {
+    "families": 10000,
+    "chunk_size": 10000,
+    "years": [1980, 1985, 1990, 1995, 2000, 2005, 2010, 2015, 2020],
+    "coverage": {
+      "lmdb": (1995, None),
+      "lpr2": (None, 2018),
+      "lpr3": (2019, None),
+      "psyk": (None, 2013)
+    },
+    "fan_out": {
+      "lmdb": { "mean": 10, "dispersion": 1 },
+      "patient_icd8": { "mean": 2, "dispersion": 1 },
+      "patient_icd10": { "mean": 2, "dispersion": 1 },
+      "diag_icd10": { "mean": 1.5, "dispersion": 2 },
+      "lpr_adm": { "mean": 3, "dispersion": 1 },
+      "lpr_diag": { "mean": 1.5, "dispersion": 2 },
+      "psyk_adm": { "mean": 1, "dispersion": 0.5 },
+      "psyk_diag": { "mean": 1.5, "dispersion": 2 },
+      "lpr_f_kontakter": { "mean": 10, "dispersion": 0.5 },
+      "lpr_f_diagnoser": { "mean": 3, "dispersion": 2 }
+    },
+    "atc_weights": None
+  },
+  "production-like": {
+    "families": 100000,
+    "chunk_size": 1000,
+    "years": list(range(1977, 2023)),
+    "coverage": {
+      "lmdb": (1995, None),
+      "lpr2": (None, 2018),
+      "lpr3": (2019, None),
+      "psyk": (None, 2013)
+    },
+    "fan_out": {
+      "lmdb": { "mean": 100, "dispersion": 0.5 },
+      "patient_icd8": { "mean": 2, "dispersion": 0.3 },
+      "patient_icd10": { "mean": 2, "dispersion": 0.3 },
+      "diag_icd10": { "mean": 2, "dispersion": 2 },
+      "lpr_adm": { "mean": 8, "dispersion": 0.5 },
+      "lpr_diag": { "mean": 2, "dispersion": 2 },
+      "psyk_adm": { "mean": 1, "dispersion": 0.2 },
+      "psyk_diag": { "mean": 2, "dispersion": 2 },
+      "lpr_f_kontakter": { "mean": 40, "dispersion": 0.5 },
+      "lpr_f_diagnoser": { "mean": 4, "dispersion": 2 }
+    },
+    # Rough share of prescriptions per ATC main group, cardiovascular (C) and
+    # nervous system (N) drugs make up the largest partitions
+    "atc_weights": {
+      "A": 0.12, "B": 0.06, "C": 0.18, "D": 0.05, "G": 0.06, "H": 0.04, "J": 0.10, "L": 0.02,
+      "M": 0.07, "N": 0.19, "P": 0.005, "Q": 0.001, "R": 0.08, "S": 0.02, "V": 0.004
+    }
+  }
+}
+
+# Order of the datasets in the stage1 section of the metadata file
+STAGE1_DATASETS = [
+  "bef",
+  "lmdb",
+  "ind",
+  "dodsaars",
+  "dodsaasg",
+  "faik",
+  "udda",
+  "ras",
+  "akm",
+  "lpr_adm",
+  "lpr_diag",
+  "psyk_adm",
+  "psyk_diag",
+  "lpr_f_kontakter",
+  "lpr_f_diagnoser",
+  "patient_icd8",
+  "patient_icd10",
+  "diag_icd10"
+]
+
 #-------------------------------------------------------------------------------
 # Logger setup
 
@@ -41,14 +173,21 @@ logger.addHandler(stream_handler)
 #-------------------------------------------------------------------------------
 # BEF
 
-def fake_bef_person(fake, gender, family, residency, mother=None, father=None):
+def unique_ids(numbers, multiplier):
+  """
+  Returns the id of each person or family number, which is different for every
+  number below ID_SPACE.
+  """
+  return ((numbers + 1) * multiplier) % ID_SPACE
+
+def fake_bef_person(fake, person, gender, family, residency, mother=None, father=None):
   if mother is None and father is None:
     born_at = fake.past_date(start_date='-40y').strftime(DATE_FORMAT)
   else:
     born_at = fake.past_date(start_date='-20y').strftime(DATE_FORMAT)
 
   return {
-    "PNR": fake.random_int(max=9999999),
+    "PNR": unique_ids(person, PERSON_ID_MULTIPLIER),
     "KOEN": gender,
     "FOED_DAG": born_at,
     "FOEDREG_KODE": fake.random_int(min=1, max=9999),
@@ -60,9 +199,9 @@ def fake_bef_person(fake, gender, family, residency, mother=None, father=None):
     "BOP_VFRA": residency["starts_at"],
   }
 
-def fake_bef_family(fake):
+def fake_bef_family(fake, family_number):
   family = {
-    "id": fake.random_int(max=9999999)
+    "id": unique_ids(family_number, FAMILY_ID_MULTIPLIER)
   }
 
   residency = {
@@ -71,20 +210,28 @@ def fake_bef_family(fake):
     "starts_at": fake.past_date(start_date='-10y').strftime(DATE_FORMAT)
   }
 
-  mother = fake_bef_person(fake, 2, family, residency)
-  father = fake_bef_person(fake, 1, family, residency)
-  child  = fake_bef_person(fake, fake.random_int(min=1, max=2), family, residency, mother, father)
+  # Every family is made up of three consecutive persons: mother, father and child
+  mother = fake_bef_person(fake, 3 * family_number, 2, family, residency)
+  father = fake_bef_person(fake, 3 * family_number + 1, 1, family, residency)
+  child  = fake_bef_person(fake, 3 * family_number + 2, fake.random_int(min=1, max=2), family, residency, mother, father)
 
   return [mother, father, child]
 
-def fake_bef_dataset(fake, rows_count):
+def fake_bef_dataset(fake, families_count, first_family=0):
   result = []
 
-  for _ in range(rows_count):
-    result += fake_bef_family(fake)
+  for family_number in range(first_family, first_family + families_count):
+    result += fake_bef_family(fake, family_number)
 
   return result
 
+def fake_bef_rows(bef_datasets, start, stop):
+  """
+  Returns the rows of the families from start to stop of consecutive BEF
+  datasets.
+  """
+  return [row for bef_dataset in bef_datasets for row in bef_dataset][3 * start:3 * stop]
+
 #-------------------------------------------------------------------------------
 # LMDB
 
@@ -570,6 +717,394 @@ def fake_akm_dataset(fake, bef_datasets, year):
 
   return result
 
+#-------------------------------------------------------------------------------
+# Columnar engine
+#
+# The columnar_* functions mirror the fake_* functions above, but build each
+# dataset as an ordered dict of NumPy columns instead of a list of dicts. Whole
+# columns are drawn at once from a single random generator, which makes it
+# feasible to generate datasets with tens of millions of rows.
+
+def columnar_random_ints(rng, size, min=0, max=9999):
+  return rng.integers(min, max, size=size, endpoint=True)
+
+def columnar_random_elements(rng, elements, size, weights=None):
+  elements = np.asarray(elements)
+
+  if weights is not None:
+    weights = np.asarray(weights, dtype=np.float64)
+
+    return elements[rng.choice(len(elements), size=size, p=weights / weights.sum())]
+
+  return elements[rng.integers(0, len(elements), size=size)]
+
+def columnar_bothify(rng, text, letters, size):
+  pools = {
+    "?": np.frombuffer(letters.encode("ascii"), dtype="S1"),
+    "#": np.frombuffer(b"0123456789", dtype="S1")
+  }
+
+  chars = np.empty((size, len(text)), dtype="S1")
+
+  for pos, char in enumerate(text):
+    if char in pools:
+      chars[:, pos] = columnar_random_elements(rng, pools[char], size)
+    else:
+      chars[:, pos] = char.encode("ascii")
+
+  return chars.view(f"S{len(text)}").ravel().astype(f"U{len(text)}")
+
+def columnar_past_dates(rng, start_dates, size=None):
+  """
+  Vectorized version of Faker.past_date, draws a date between each start date
+  and yesterday.
+  """
+  yesterday   = np.datetime64(datetime.date.today() - datetime.timedelta(days=1), "D")
+  start_dates = np.asarray(start_dates, dtype="datetime64[D]")
+
+  if size is not None:
+    start_dates = np.broadcast_to(start_dates, size)
+
+  spans = np.maximum((yesterday - start_dates).astype(np.int64), 0)
+
+  return start_dates + rng.integers(0, spans, endpoint=True).astype("timedelta64[D]")
+
+def columnar_relative_date(years):
+  return np.datetime64(datetime.date.today() - relativedelta(years=years), "D")
+
+def columnar_fan_out(rng, parents_count, fan_out):
+  """
+  Returns the parent row index of each child row, where the amount of children
+  per parent is drawn as described by the fan-out of a profile.
+  """
+  if "mean" in fan_out:
+    shape  = fan_out["dispersion"]
+    counts = rng.poisson(rng.gamma(shape, fan_out["mean"] / shape, size=parents_count))
+  else:
+    counts = columnar_random_ints(rng, parents_count, min=fan_out["min"], max=fan_out["max"])
+
+  return np.repeat(np.arange(parents_count), counts)
+
+def columnar_atc_codes(rng, size, atc_weights):
+  if atc_weights is None:
+    return columnar_bothify(rng, "?##??##", ATC_CATEGORIES, size)
+
+  categories = columnar_random_elements(rng, list(atc_weights.keys()), size, list(atc_weights.values()))
+
+  return np.char.add(categories, columnar_bothify(rng, "##??##", ATC_CATEGORIES, size))
+
+def columnar_bef_dataset(rng, families_count, first_family=0):
+  # Every family is made up of three consecutive rows: mother, father and child
+  shape          = (families_count, 3)
+  family_numbers = first_family + np.arange(families_count)
+
+  pnrs = unique_ids(3 * family_numbers[:, None] + np.arange(3), PERSON_ID_MULTIPLIER)
+
+  genders       = np.empty(shape, dtype=np.int64)
+  genders[:, 0] = 2
+  genders[:, 1] = 1
+  genders[:, 2] = columnar_random_ints(rng, families_count, min=1, max=2)
+
+  born_at       = np.empty(shape, dtype="datetime64[D]")
+  born_at[:, 0] = columnar_past_dates(rng, columnar_relative_date(40), families_count)
+  born_at[:, 1] = columnar_past_dates(rng, columnar_relative_date(40), families_count)
+  born_at[:, 2] = columnar_past_dates(rng, columnar_relative_date(20), families_count)
+
+  # Only the child has a mother and father
+  no_parents       = np.ones(shape, dtype=bool)
+  no_parents[:, 2] = False
+  mother_ids       = np.ma.masked_array(np.repeat(pnrs[:, 0], 3), no_parents.ravel())
+  father_ids       = np.ma.masked_array(np.repeat(pnrs[:, 1], 3), no_parents.ravel())
+
+  family_ids       = unique_ids(family_numbers, FAMILY_ID_MULTIPLIER)
+  residency_ids    = columnar_random_ints(rng, families_count, max=9999999)
+  municipality_ids = columnar_random_ints(rng, families_count, max=9999999)
+  residency_starts = columnar_past_dates(rng, columnar_relative_date(10), families_count)
+
+  return OrderedDict([
+    ("PNR", pnrs.ravel()),
+    ("KOEN", genders.ravel()),
+    ("FOED_DAG", born_at.ravel()),
+    ("FOEDREG_KODE", columnar_random_ints(rng, shape, min=1, max=9999).ravel()),
+    ("MOR_ID", mother_ids),
+    ("FAR_ID", father_ids),
+    ("FAMILIE_ID", np.repeat(family_ids, 3)),
+    ("ADRESSE_ID", np.repeat(residency_ids, 3)),
+    ("BOPIKOM", np.repeat(municipality_ids, 3)),
+    ("BOP_VFRA", np.repeat(residency_starts, 3))
+  ])
+
+def columnar_bef_rows(bef_datasets, start, stop):
+  """
+  Returns the rows of the families from start to stop of consecutive BEF
+  datasets.
+  """
+  def concatenate(columns):
+    return np.ma.concatenate(columns) if np.ma.isMaskedArray(columns[0]) else np.concatenate(columns)
+
+  return OrderedDict([
+    (col, concatenate([bef_dataset[col] for bef_dataset in bef_datasets])[3 * start:3 * stop]) for col in bef_datasets[0]
+  ])
+
+def columnar_lmdb_dataset(rng, bef_dataset, profile):
+  idx = columnar_fan_out(rng, len(bef_dataset["PNR"]), profile["fan_out"]["lmdb"])
+  n   = len(idx)
+
+  return OrderedDict([
+    ("PNR", bef_dataset["PNR"][idx]),
+    ("ATC", columnar_atc_codes(rng, n, profile["atc_weights"])),
+    ("IBNR", columnar_random_ints(rng, n, max=9999999)),
+    ("EKSD", columnar_past_dates(rng, bef_dataset["FOED_DAG"][idx])),
+    ("VOLUME", columnar_random_ints(rng, n, min=1, max=1000)),
+    ("VOLTYPECODE", columnar_random_elements(rng, ["ST", "DW", "ML"], n)),
+    ("PACKSIZE", columnar_random_ints(rng, n, min=1, max=200)),
+    ("STRNUM", columnar_random_ints(rng, n, min=1, max=999999)),
+    ("STRUNIT", columnar_random_elements(rng, ["PC", "BHS", "MGM", "SQM"], n)),
+    ("DOSFORM", columnar_random_elements(rng, ["INJVSKS", "PULORES", "SOLVPA"], n))
+  ])
+
+def columnar_ind_dataset(rng, bef_dataset, period_date):
+  n = len(bef_dataset["PNR"])
+
+  # Same as relativedelta(period_date, birth_date).years, since the period
+  # date is the last second of the year
+  birth_years  = bef_dataset["FOED_DAG"].astype("datetime64[Y]").astype(np.int64) + 1970
+  relative_age = period_date.year - birth_years + (birth_years > period_date.year)
+
+  social_contrib_income  = columnar_random_ints(rng, n, max=999999)
+  employment_income      = columnar_random_ints(rng, n, max=999999)
+  social_income          = columnar_random_ints(rng, n, max=999999)
+  private_pension_income = np.where(relative_age > 65, columnar_random_ints(rng, n, max=999999), 0)
+  rest_income            = columnar_random_ints(rng, n, max=999999)
+  all_income             = employment_income + social_income + private_pension_income + rest_income
+  total_taxes            = all_income * 0.38
+
+  return OrderedDict([
+    ("PNR", bef_dataset["PNR"]),
+    ("ALDER_ULT_INK", relative_age),
+    ("BESKST13", np.full(n, "08")),
+    ("OMFANG", np.full(n, 1)),
+    ("PERINDKIALT_13", social_contrib_income + social_income + private_pension_income + rest_income),
+    ("LOENMV_13", employment_income),
+    ("ERHVERVSINDK_13", social_contrib_income),
+    ("OFF_OVERFORSEL_13", social_income),
+    ("PRIVAT_PENSION_13", private_pension_income),
+    ("RESUINK_13", rest_income),
+    ("SKATTOT_13", total_taxes)
+  ])
+
+def columnar_faik_dataset(rng, bef_dataset, period_date):
+  # One row per family, in order of first appearance, like mk_families_dataset
+  _, first_idx = np.unique(bef_dataset["FAMILIE_ID"], return_index=True)
+  family_ids   = bef_dataset["FAMILIE_ID"][np.sort(first_idx)]
+  n            = len(family_ids)
+
+  social_contrib_income  = columnar_random_ints(rng, n, max=999999)
+  employment_income      = columnar_random_ints(rng, n, max=999999)
+  social_income          = columnar_random_ints(rng, n, max=999999)
+  private_pension_income = columnar_random_ints(rng, n, max=999999)
+  rest_income            = columnar_random_ints(rng, n, max=999999)
+  all_income             = employment_income + social_income + private_pension_income + rest_income
+  total_taxes            = all_income * 0.38
+
+  return OrderedDict([
+    ("FAMILIE_ID", family_ids),
+    ("FAMTYPE", np.full(n, 1)),
+    ("FAMINDKOMSTIALT_13", social_contrib_income + social_income + private_pension_income + rest_income),
+    ("FAMLOENMV_13", employment_income),
+    ("FAMERHVERVSINDK_13", social_contrib_income),
+    ("FAMOFF_OVERFORSEL_13", social_income),
+    ("FAMPRIVAT_PENSION_13", private_pension_income),
+    ("FAMRESTINDK_13", rest_income),
+    ("FAMSKATTOT_13", total_taxes)
+  ])
+
+def columnar_pcr_patient_icd8_dataset(rng, bef_dataset, profile):
+  idx        = columnar_fan_out(rng, len(bef_dataset["PNR"]), profile["fan_out"]["patient_icd8"])
+  n          = len(idx)
+  start_date = columnar_past_dates(rng, bef_dataset["FOED_DAG"][idx])
+
+  return OrderedDict([
+    ("PAT_SEQ", columnar_random_ints(rng, n, max=9999999)),
+    ("CPRNR", bef_dataset["PNR"][idx]),
+    ("PTTYPE", columnar_random_elements(rng, [0, 1, 2, 4, 5], n)),
+    ("INDLDATO", start_date),
+    ("UDSKDATO", columnar_past_dates(rng, start_date)),
+    ("HOVEDDIAG", columnar_random_elements(rng, ["00999", "11609", "42009"], n)),
+    ("MODIFHD", columnar_random_ints(rng, n, max=9))
+  ])
+
+def columnar_pcr_diag_icd10_dataset(rng, pcr_records, profile):
+  idx = columnar_fan_out(rng, len(pcr_records["PAT_SEQ"]), profile["fan_out"]["diag_icd10"])
+  n   = len(idx)
+
+  return OrderedDict([
+    ("PAT_SEQ", pcr_records["PAT_SEQ"][idx]),
+    ("DIAG", columnar_random_elements(rng, ["DF20", "DF30", "DF25"], n)),
+    ("DART", columnar_random_elements(rng, ["0", "A", "B", "G", "H"], n))
+  ])
+
+def columnar_pcr_patient_icd10_dataset(rng, bef_dataset, profile):
+  idx        = columnar_fan_out(rng, len(bef_dataset["PNR"]), profile["fan_out"]["patient_icd10"])
+  n          = len(idx)
+  start_date = columnar_past_dates(rng, bef_dataset["FOED_DAG"][idx])
+
+  return OrderedDict([
+    ("PAT_SEQ", columnar_random_ints(rng, n, max=9999999)),
+    ("CPRNR", bef_dataset["PNR"][idx]),
+    ("PTTYPE", columnar_random_elements(rng, [0, 1, 2, 4, 5], n)),
+    ("INDLDATO", start_date),
+    ("UDSKDATO", columnar_past_dates(rng, start_date))
+  ])
+
+def columnar_adm_diag_dataset(rng, bef_dataset, patient_kinds, adm_fan_out, diag_fan_out):
+  """
+  Shared by LPR2 and PSYK, which only differ in what patient kinds they use.
+  """
+  adm_idx    = columnar_fan_out(rng, len(bef_dataset["PNR"]), adm_fan_out)
+  n          = len(adm_idx)
+  start_date = columnar_past_dates(rng, bef_dataset["FOED_DAG"][adm_idx])
+
+  adm = OrderedDict([
+    ("RECNUM", columnar_random_ints(rng, n, max=9999999)),
+    ("PNR", bef_dataset["PNR"][adm_idx]),
+    ("C_PATTYPE", columnar_random_elements(rng, patient_kinds, n)),
+    ("D_INDDTO", start_date),
+    ("D_UDDTO", columnar_past_dates(rng, start_date))
+  ])
+
+  diag_idx = columnar_fan_out(rng, n, diag_fan_out)
+
+  diag = OrderedDict([
+    ("RECNUM", adm["RECNUM"][diag_idx]),
+    ("C_DIAG", columnar_random_elements(rng, ["00999", "11609", "42009", "DF20", "DF30", "DF25"], len(diag_idx))),
+    ("C_DIAGTYPE", columnar_random_elements(rng, ["A", "B"], len(diag_idx)))
+  ])
+
+  return (adm, diag)
+
+def columnar_lpr2_adm_diag_dataset(rng, bef_dataset, profile):
+  fan_out = profile["fan_out"]
+
+  return columnar_adm_diag_dataset(rng, bef_dataset, [0, 1, 2, 4, 5], fan_out["lpr_adm"], fan_out["lpr_diag"])
+
+def columnar_psyk_adm_diag_dataset(rng, bef_dataset, profile):
+  fan_out = profile["fan_out"]
+
+  return columnar_adm_diag_dataset(rng, bef_dataset, [0, 1, 2, 3], fan_out["psyk_adm"], fan_out["psyk_diag"])
+
+def columnar_lpr3_kontakter_diagnoser_dataset(rng, bef_dataset, profile):
+  kontakt_idx = columnar_fan_out(rng, len(bef_dataset["PNR"]), profile["fan_out"]["lpr_f_kontakter"])
+  n           = len(kontakt_idx)
+  start_date  = columnar_past_dates(rng, bef_dataset["FOED_DAG"][kontakt_idx])
+
+  kontakter = OrderedDict([
+    ("DW_EK_KONTAKT", columnar_random_ints(rng, n, max=9999999)),
+    ("PNR", bef_dataset["PNR"][kontakt_idx]),
+    ("KONTAKTTYPE", columnar_random_elements(rng, ["ALCA00", "ALCA01", "ALCA03", "ALCA10", "ALCA20"], n)),
+    ("DATO_START", start_date),
+    ("DATO_SLUT", columnar_past_dates(rng, start_date))
+  ])
+
+  diagnose_idx = columnar_fan_out(rng, n, profile["fan_out"]["lpr_f_diagnoser"])
+  m            = len(diagnose_idx)
+  codes        = ["00999", "11609", "42009", "DF20", "DF30", "DF25"]
+  typ          = columnar_random_elements(rng, ["A", "B", "+"], m)
+
+  diagnoser = OrderedDict([
+    ("DW_EK_KONTAKT", kontakter["DW_EK_KONTAKT"][diagnose_idx]),
+    ("DIAGNOSEKODE", columnar_random_elements(rng, codes, m)),
+    ("DIAGNOSEKODE_PARENT", np.where(typ == "+", columnar_random_elements(rng, codes, m), "")),
+    ("DIAGNOSETYPE", typ)
+  ])
+
+  return (kontakter, diagnoser)
+
+def columnar_deaths_dataset(rng, bef_dataset, date_column, cause_columns, causes):
+  """
+  Shared by DODSAARS and DODSAASG, which only differ in column names and codes.
+  """
+  n = len(bef_dataset["PNR"])
+
+  result = OrderedDict([
+    ("PNR", bef_dataset["PNR"]),
+    (date_column, columnar_past_dates(rng, bef_dataset["FOED_DAG"])),
+    ("C_DODSMAADE", columnar_random_elements(rng, C_DODSMAADE_VALUES, n))
+  ])
+
+  for col in cause_columns:
+    result[col] = columnar_random_elements(rng, causes, n)
+
+  return result
+
+def columnar_dodsaars_dataset(rng, bef_dataset):
+  return columnar_deaths_dataset(
+    rng,
+    bef_dataset,
+    "D_DODSDTO",
+    ["C_DOD1", "C_DOD2", "C_DOD3", "C_DOD4"],
+    ["9523", "2990", "9869", "I709", "J449", "I251"]
+  )
+
+def columnar_dodsaasg_dataset(rng, bef_dataset):
+  return columnar_deaths_dataset(
+    rng,
+    bef_dataset,
+    "D_DODSDATO",
+    ["C_DOD_1A", "C_DOD_1B", "C_DOD_1C", "C_DOD_1D"],
+    ["X59", "R549", "I709", "J449", "I251"]
+  )
+
+def columnar_udda_dataset(rng, bef_dataset, year):
+  n = len(bef_dataset["PNR"])
+
+  return OrderedDict([
+    ("PNR", bef_dataset["PNR"]),
+    ("HFAUDD", columnar_random_elements(rng, ["1006", "2461", "4071"], n)),
+    ("HFINSTNR", columnar_random_elements(rng, ["101087", "615010", "751406"], n)),
+    ("HF_KILDE", columnar_random_elements(rng, ["1", "9", "17"], n)),
+    ("HF_VFRA", columnar_past_dates(rng, bef_dataset["FOED_DAG"])),
+    ("UDD", columnar_random_elements(rng, ["5189", "5166"], n))
+  ])
+
+def columnar_ras_dataset(rng, bef_dataset, year):
+  n     = len(bef_dataset["PNR"])
+  empty = np.full(n, "")
+
+  result = OrderedDict([
+    ("PNR", bef_dataset["PNR"]),
+    ("ARBSTIL", empty),
+    ("NYARB", empty),
+    ("SOCSTIL_KODE", empty),
+    ("SOC_STATUS_KODE", empty),
+    ("BRANCHE_77", empty),
+    ("BRANCHE_KODE", empty),
+    ("ARB_HOVED_BRA_DB07", empty)
+  ])
+
+  # See fake_ras_record for the sources of the year ranges
+  if year <= 1993:
+    result["ARBSTIL"] = columnar_random_elements(rng, [11, 12, 13, 14, 20, 31, 32, 40, 50, 92], n)
+  elif year >= 1994 and year <= 1995:
+    result["NYARB"] = columnar_random_elements(rng, [11, 12, 13, 14, 20, 31, 32, 40, 50, 92], n)
+  elif year >= 1996 and year <= 2007:
+    result["SOCSTIL_KODE"] = columnar_random_elements(rng, [115, 118, 130, 200, 316, 400], n)
+  else:
+    result["SOC_STATUS_KODE"] = columnar_random_elements(rng, [115, 118, 130, 200, 316, 612], n)
+
+  if year <= 1992:
+    result["BRANCHE_77"] = columnar_random_elements(rng, ["00000", "10000", "34199", "99999"], n)
+  elif year >= 1992 and year <= 2007:
+    result["BRANCHE_KODE"] = columnar_random_elements(rng, [34199, 174090, 182210], n)
+  else:
+    result["ARB_HOVED_BRA_DB07"] = columnar_random_elements(rng, ["011100", "641100", "771100", "851000"], n)
+
+  return result
+
+def columnar_akm_dataset(rng, bef_dataset, year):
+  # Mirrors fake_akm_dataset, which uses the RAS records
+  return columnar_ras_dataset(rng, bef_dataset, year)
+
 #-------------------------------------------------------------------------------
 # Utilities
 
@@ -587,141 +1122,488 @@ def mk_families_dataset(bef_dataset):
 
   return result
 
-def write_dataset(dataset, output_directory, name):
-  csv_path = os.path.join(output_directory, f"{name}.csv")
-  cols        = list(dataset[0].keys())
+def write_sas7bdat(manifest, workers):
+  """
+  Converts every CSV file in the manifest to sas7bdat, using a single R process
+  that converts up to the given amount of files in parallel.
+  """
+  # Largest files first, so that the small files fill in at the end
+  manifest = sorted(manifest, key=lambda entry: os.path.getsize(entry["input"]), reverse=True)
+
+  (fd, manifest_path) = tempfile.mkstemp(prefix=f"{SCRIPT_NAME}-", suffix=".json")
+
+  with os.fdopen(fd, "w") as f:
+    f.write(json.dumps(manifest, indent=2))
+
+  logger.info(f"Converting {len(manifest)} datasets to sas7bdat, using {workers} workers")
+
+  try:
+    check_call(["./bin/csv-to-sas7bdat.R", manifest_path, str(workers)], cwd=PROJECT_DIR)
+  finally:
+    os.remove(manifest_path)
+
+class DatasetWriter:
+  """
+  Writes a dataset to a CSV file one chunk at a time, so that no more than a
+  single chunk is held in memory.
+  """
+
+  def __init__(self, output_directory, name, write_chunk):
+    self.output_directory = output_directory
+    self.name             = name
+    self.csv_path         = os.path.join(output_directory, f"{name}.csv")
+    self.sas_path         = os.path.join(output_directory, f"{name}.sas7bdat")
+    self.write_chunk      = write_chunk
+    self.cols             = None
+
+    logger.info(f"Writing dataset {name}")
+
+    self.file = open(self.csv_path, "w", newline="")
+
+  def write(self, chunk):
+    self.cols = self.write_chunk(self.file, chunk, self.cols)
+
+  def close(self):
+    self.file.close()
 
-  logger.info(f"Writing dataset {name}")
+    if self.cols is None:
+      raise ValueError(f"Dataset {self.name} does not contain any rows")
 
-  with open(csv_path, "w", newline="") as f:
-    writer = csv.DictWriter(f, delimiter=",", quotechar="\"", quoting=csv.QUOTE_MINIMAL, fieldnames=cols, dialect="unix")
+    logger.info(f"Dataset {self.name} written to file {self.csv_path}")
+
+    return self.cols
+
+def write_rows(f, dataset, cols):
+  """
+  Writes a chunk of rows, and the header if no columns have been written yet.
+  """
+  if len(dataset) == 0:
+    return cols
+
+  writer = csv.DictWriter(f, delimiter=",", quotechar="\"", quoting=csv.QUOTE_MINIMAL, fieldnames=list(dataset[0].keys()), dialect="unix")
+
+  if cols is None:
     writer.writeheader()
 
-    for row in dataset:
-      writer.writerow(row)
+  writer.writerows(dataset)
+
+  return writer.fieldnames
+
+def columnar_digits(values, width):
+  powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+
+  return ((values[:, None] // powers) % 10 + ord("0")).astype(np.uint8)
+
+def columnar_int_bytes(column, min_width=1):
+  values    = column.astype(np.int64)
+  magnitude = np.abs(values)
+  width     = max(len(str(magnitude.max())) if len(values) > 0 else 1, min_width)
+  powers    = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+
+  # Leading zeros become padding, except for the last min_width digits
+  significant = (magnitude[:, None] >= powers) | (powers < 10 ** min_width)
+  chars       = np.where(significant, columnar_digits(magnitude, width), 0).astype(np.uint8)
+
+  negative = values < 0
+
+  if negative.any():
+    chars = np.hstack([np.zeros((len(values), 1), dtype=np.uint8), chars])
+    chars[negative, width - significant[negative].sum(axis=1)] = ord("-")
 
-  sas_path = os.path.join(output_directory, f"{name}.sas7bdat")
+  return chars
 
-  check_call(["./bin/csv-to-sas7bdat.R", csv_path, sas_path], cwd=PROJECT_DIR)
+def columnar_to_bytes(column):
+  """
+  Renders a column as a matrix of ASCII bytes with one row per value, where
+  NUL bytes are padding that is removed when the rows are written. Masked
+  values are written as empty fields and floats are written with two decimals.
+  """
+  rows = len(column)
 
-  logger.info(f"Dataset {name} written to file {csv_path} and {sas_path}")
+  # Chunks of the smaller datasets can be empty, e.g. when no family in a BEF
+  # chunk has psychiatric admissions
+  if rows == 0:
+    return np.zeros((0, 0), dtype=np.uint8)
+
+  if np.ma.isMaskedArray(column):
+    chars = columnar_to_bytes(column.data)
+    chars[np.ma.getmaskarray(column)] = 0
+
+    return chars
+
+  if column.dtype.kind in "iu":
+    return columnar_int_bytes(column)
+
+  if column.dtype.kind == "f":
+    cents = columnar_int_bytes(np.rint(column * 100), min_width=3)
+    dot   = np.full((rows, 1), ord("."), dtype=np.uint8)
+
+    return np.hstack([cents[:, :-2], dot, cents[:, -2:]])
+
+  if column.dtype.kind == "M":
+    days   = column.astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    dash   = np.full((rows, 1), ord("-"), dtype=np.uint8)
+
+    return np.hstack([
+      columnar_digits(months.astype("datetime64[Y]").astype(np.int64) + 1970, 4),
+      dash,
+      columnar_digits(months.astype(np.int64) % 12 + 1, 2),
+      dash,
+      columnar_digits((days - months).astype(np.int64) + 1, 2)
+    ])
+
+  if column.dtype.kind == "U":
+    codes = np.ascontiguousarray(column).view(np.uint32).reshape(rows, -1)
+
+    if (codes > 127).any():
+      raise ValueError("Only ASCII values can be written by the columnar engine")
+
+    return codes.astype(np.uint8)
+
+  strings = np.array(list(map(str, column.tolist())), dtype="S")
+
+  return strings.view(np.uint8).reshape(rows, -1)
+
+def write_columns(f, dataset, cols):
+  """
+  Writes a chunk of columns, and the header if no columns have been written yet.
+  """
+  if cols is None:
+    cols = list(dataset.keys())
+    f.write(",".join(cols) + "\n")
+
+  rows = len(dataset[cols[0]])
+
+  # Every row is rendered as fixed width bytes, and the padding is then
+  # stripped from the whole chunk in one go
+  separator = np.full((rows, 1), ord(","), dtype=np.uint8)
+  newline   = np.full((rows, 1), ord("\n"), dtype=np.uint8)
+  parts     = []
+
+  for col in cols:
+    chars = columnar_to_bytes(dataset[col])
+
+    if np.isin(chars, [ord(","), ord("\""), ord("\n")]).any():
+      raise ValueError(f"Column {col} contains values that would need quoting")
+
+    parts += [chars, separator]
+
+  parts[-1] = newline
+  data      = np.hstack(parts).ravel()
+
+  f.write(data[data != 0].tobytes().decode("ascii"))
 
   return cols
 
 #-------------------------------------------------------------------------------
+# Datasets
+#
+# Each engine derives the datasets of a single BEF chunk. They are returned as
+# a dict of dataset groups, where each group is a function that takes a random
+# generator and returns (metadata key, file name, dataset chunk) tuples. The
+# Faker engine only supports the fan-outs of the small profile.
 
-def main(args):
+def fake_yearly_datasets(bef_dataset, year, profile):
+  period      = f"{year}12"
+  period_date = datetime.datetime(year, 12, 31, 23, 59, 59)
+
+  def lpr2(fake):
+    (adm_dataset, diag_dataset) = fake_lpr2_adm_diag_dataset(fake, bef_dataset)
+
+    return [("lpr_adm", f"lpr_adm{year}", adm_dataset), ("lpr_diag", f"lpr_diag{year}", diag_dataset)]
+
+  def lpr3(fake):
+    (kontakter_dataset, diagnoser_dataset) = fake_lpr3_kontakter_diagnoser_dataset(fake, bef_dataset)
+
+    return [("lpr_f_kontakter", f"lpr_f_kontakter{year}", kontakter_dataset), ("lpr_f_diagnoser", f"lpr_f_diagnoser{year}", diagnoser_dataset)]
+
+  def psyk(fake):
+    (adm_dataset, diag_dataset) = fake_psyk_adm_diag_dataset(fake, bef_dataset)
+
+    return [("psyk_adm", f"psyk_adm{year}", adm_dataset), ("psyk_diag", f"psyk_diag{year}", diag_dataset)]
+
+  return {
+    "bef": lambda fake: [("bef", f"bef{period}", bef_dataset)],
+    "lmdb": lambda fake: [("lmdb", f"lmdb{period}", fake_lmdb_dataset(fake, bef_dataset))],
+    "ind": lambda fake: [("ind", f"ind{year}", fake_ind_dataset(fake, bef_dataset, period_date))],
+    "dodsaars": lambda fake: [("dodsaars", f"dodsaars{year}", fake_dodsaars_dataset(fake, bef_dataset))],
+    "dodsaasg": lambda fake: [("dodsaasg", f"dodsaasg{year}", fake_dodsaasg_dataset(fake, bef_dataset))],
+    "faik": lambda fake: [("faik", f"faik{year}", fake_faik_dataset(fake, mk_families_dataset(bef_dataset), period_date))],
+    "udda": lambda fake: [("udda", f"udda{year}", fake_udda_dataset(fake, bef_dataset, year))],
+    "ras": lambda fake: [("ras", f"ras{year}", fake_ras_dataset(fake, bef_dataset, year))],
+    "akm": lambda fake: [("akm", f"akm{year}", fake_akm_dataset(fake, bef_dataset, year))],
+    "lpr2": lpr2,
+    "lpr3": lpr3,
+    "psyk": psyk
+  }
+
+def fake_external_datasets(bef_dataset, profile):
+  def pcr_icd10(fake):
+    patient_dataset = fake_pcr_patient_icd10_dataset(fake, bef_dataset)
+    diag_dataset    = fake_pcr_diag_icd10_dataset(fake, patient_dataset)
+
+    return [("patient_icd10", "patient_icd10", patient_dataset), ("diag_icd10", "diag_icd10", diag_dataset)]
+
+  return {
+    "pcr_icd8": lambda fake: [("patient_icd8", "patient_icd8", fake_pcr_patient_icd8_dataset(fake, bef_dataset))],
+    "pcr_icd10": pcr_icd10
+  }
+
+def fake_generator(seed):
   fake = Faker()
+  fake.seed_instance(seed)
+
+  return fake
+
+def columnar_yearly_datasets(bef_dataset, year, profile):
+  period      = f"{year}12"
+  period_date = datetime.datetime(year, 12, 31, 23, 59, 59)
+
+  def lpr2(rng):
+    (adm_dataset, diag_dataset) = columnar_lpr2_adm_diag_dataset(rng, bef_dataset, profile)
+
+    return [("lpr_adm", f"lpr_adm{year}", adm_dataset), ("lpr_diag", f"lpr_diag{year}", diag_dataset)]
+
+  def lpr3(rng):
+    (kontakter_dataset, diagnoser_dataset) = columnar_lpr3_kontakter_diagnoser_dataset(rng, bef_dataset, profile)
+
+    return [("lpr_f_kontakter", f"lpr_f_kontakter{year}", kontakter_dataset), ("lpr_f_diagnoser", f"lpr_f_diagnoser{year}", diagnoser_dataset)]
+
+  def psyk(rng):
+    (adm_dataset, diag_dataset) = columnar_psyk_adm_diag_dataset(rng, bef_dataset, profile)
+
+    return [("psyk_adm", f"psyk_adm{year}", adm_dataset), ("psyk_diag", f"psyk_diag{year}", diag_dataset)]
+
+  return {
+    "bef": lambda rng: [("bef", f"bef{period}", bef_dataset)],
+    "lmdb": lambda rng: [("lmdb", f"lmdb{period}", columnar_lmdb_dataset(rng, bef_dataset, profile))],
+    "ind": lambda rng: [("ind", f"ind{year}", columnar_ind_dataset(rng, bef_dataset, period_date))],
+    "dodsaars": lambda rng: [("dodsaars", f"dodsaars{year}", columnar_dodsaars_dataset(rng, bef_dataset))],
+    "dodsaasg": lambda rng: [("dodsaasg", f"dodsaasg{year}", columnar_dodsaasg_dataset(rng, bef_dataset))],
+    "faik": lambda rng: [("faik", f"faik{year}", columnar_faik_dataset(rng, bef_dataset, period_date))],
+    "udda": lambda rng: [("udda", f"udda{year}", columnar_udda_dataset(rng, bef_dataset, year))],
+    "ras": lambda rng: [("ras", f"ras{year}", columnar_ras_dataset(rng, bef_dataset, year))],
+    "akm": lambda rng: [("akm", f"akm{year}", columnar_akm_dataset(rng, bef_dataset, year))],
+    "lpr2": lpr2,
+    "lpr3": lpr3,
+    "psyk": psyk
+  }
+
+def columnar_external_datasets(bef_dataset, profile):
+  def pcr_icd10(rng):
+    patient_dataset = columnar_pcr_patient_icd10_dataset(rng, bef_dataset, profile)
+    diag_dataset    = columnar_pcr_diag_icd10_dataset(rng, patient_dataset, profile)
+
+    return [("patient_icd10", "patient_icd10", patient_dataset), ("diag_icd10", "diag_icd10", diag_dataset)]
+
+  return {
+    "pcr_icd8": lambda rng: [("patient_icd8", "patient_icd8", columnar_pcr_patient_icd8_dataset(rng, bef_dataset, profile))],
+    "pcr_icd10": pcr_icd10
+  }
+
+ENGINES = {
+  "faker": {
+    "generator": fake_generator,
+    "bef_dataset": fake_bef_dataset,
+    "bef_rows": fake_bef_rows,
+    "yearly_datasets": fake_yearly_datasets,
+    "external_datasets": fake_external_datasets,
+    "write_chunk": write_rows
+  },
+  "numpy": {
+    "generator": np.random.default_rng,
+    "bef_dataset": columnar_bef_dataset,
+    "bef_rows": columnar_bef_rows,
+    "yearly_datasets": columnar_yearly_datasets,
+    "external_datasets": columnar_external_datasets,
+    "write_chunk": write_columns
+  }
+}
+
+#-------------------------------------------------------------------------------
+# Generation
+
+def derive_seed(random_seed, *keys):
+  """
+  Derives the seed of a single dataset group chunk from the main seed, so that
+  the output does not depend on the order the chunks are generated in.
+  """
+  key    = ":".join(str(k) for k in (random_seed,) + keys)
+  digest = hashlib.sha256(key.encode("utf-8")).digest()
+
+  return int.from_bytes(digest[:8], "little")
+
+def write_chunks(writers, datasets, output_directory, write_chunk):
+  for (key, name, dataset) in datasets:
+    if name not in writers:
+      writers[name] = (key, DatasetWriter(output_directory, name, write_chunk))
+
+    writers[name][1].write(dataset)
+
+def pool_chunk_path(pool_directory, chunk_index):
+  return os.path.join(pool_directory, f"bef{chunk_index}.pickle")
+
+def write_pool_chunk(args, pool_directory, chunk_index):
+  """
+  Generates a chunk of the family pool, which does not depend on the year, and
+  stores it for the dataset groups of every year that has its families.
+  """
+  engine    = ENGINES[args.engine]
+  generator = engine["generator"](derive_seed(args.random_seed, "bef", chunk_index))
+
+  with open(pool_chunk_path(pool_directory, chunk_index), "wb") as f:
+    pickle.dump(engine["bef_dataset"](generator, args.chunk_size, chunk_index * args.chunk_size), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def pool_families(args, pool_directory, pool_chunks, start, families_count):
+  """
+  Returns the BEF rows of the given families of the family pool. The chunks of
+  the pool are read as they are needed, and kept in pool_chunks until the
+  families after them are asked for.
+  """
+  engine      = ENGINES[args.engine]
+  first_chunk = start // args.chunk_size
+  last_chunk  = (start + families_count - 1) // args.chunk_size
+
+  for chunk_index in [chunk_index for chunk_index in pool_chunks if chunk_index < first_chunk]:
+    del pool_chunks[chunk_index]
+
+  for chunk_index in range(first_chunk, last_chunk + 1):
+    if chunk_index not in pool_chunks:
+      with open(pool_chunk_path(pool_directory, chunk_index), "rb") as f:
+        pool_chunks[chunk_index] = pickle.load(f)
+
+  offset = start - first_chunk * args.chunk_size
+
+  return engine["bef_rows"](
+    [pool_chunks[chunk_index] for chunk_index in range(first_chunk, last_chunk + 1)],
+    offset,
+    offset + families_count
+  )
+
+def generate_groups(args, pool_directory, year, groups):
+  """
+  Generates the given dataset groups of a year in a single pass over the BEF
+  chunks, which are read from the family pool in pool_directory. Returns the columns of every dataset that was written, and manifest
+  entries for converting them to sas7bdat.
+  """
+  engine       = ENGINES[args.engine]
+  profile      = PROFILES[args.profile]
+  writers      = {}
+  dataset_cols = {}
+  manifest     = []
+  pool_chunks  = {}
+
+  first_family = profile["years"].index(year) * family_turnover(args)
+
+  for (chunk_index, chunk_start) in enumerate(range(0, args.bef_families_count, args.chunk_size)):
+    families_count = min(args.chunk_size, args.bef_families_count - chunk_start)
+    bef_chunk      = pool_families(args, pool_directory, pool_chunks, first_family + chunk_start, families_count)
+
+    datasets = engine["yearly_datasets"](bef_chunk, year, profile)
+    datasets.update(engine["external_datasets"](bef_chunk, profile))
+
+    for group in groups:
+      generator        = engine["generator"](derive_seed(args.random_seed, year, group, chunk_index))
+      output_directory = args.external_data_dir if group in EXTERNAL_GROUPS else args.grund_data_dir
+
+      write_chunks(writers, datasets[group](generator), output_directory, engine["write_chunk"])
+
+  for (key, writer) in writers.values():
+    dataset_cols[key] = writer.close()
+
+    manifest.append({
+      "input": writer.csv_path,
+      "output": writer.sas_path
+    })
+
+  return (dataset_cols, manifest)
+
+def family_turnover(args):
+  """
+  Returns by how many families the families of a year are shifted in the pool
+  from the year before, so the first families leave and as many new come.
+  """
+  return math.ceil(args.bef_families_count * FAMILY_TURNOVER)
 
-  if args.random_seed:
-    fake.seed_instance(args.random_seed)
-
-  for year in [1985, 1993, 2008, 2020]:
-    period = f"{year}12"
-    period_date = datetime.datetime(year, 12, 31, 23, 59, 59)
-
-    bef_dataset      = fake_bef_dataset(fake, args.bef_families_count)
-    lmdb_dataset     = fake_lmdb_dataset(fake, bef_dataset)
-    ind_dataset      = fake_ind_dataset(fake, bef_dataset, period_date)
-    dodsaars_dataset = fake_dodsaars_dataset(fake, bef_dataset)
-    dodsaasg_dataset = fake_dodsaasg_dataset(fake, bef_dataset)
-    families_dataset = mk_families_dataset(bef_dataset)
-    faik_dataset     = fake_faik_dataset(fake, families_dataset, period_date)
-    udda_dataset     = fake_udda_dataset(fake, bef_dataset, year)
-    ras_dataset      = fake_ras_dataset(fake, bef_dataset, year)
-    akm_dataset      = fake_akm_dataset(fake, bef_dataset, year)
-
-    (lpr2_adm_dataset, lpr2_diag_dataset) = fake_lpr2_adm_diag_dataset(fake, bef_dataset)
-    (lpr3_kontakter_dataset, lpr3_diagnoser_dataset) = fake_lpr3_kontakter_diagnoser_dataset(fake, bef_dataset)
-    (psyk_adm_dataset, psyk_diag_dataset) = fake_psyk_adm_diag_dataset(fake, bef_dataset)
-
-    bef_cols            = write_dataset(bef_dataset, args.grund_data_dir, f"bef{period}")
-    lmdb_cols           = write_dataset(lmdb_dataset, args.grund_data_dir, f"lmdb{period}")
-    ind_cols            = write_dataset(ind_dataset, args.grund_data_dir, f"ind{year}")
-    dodsaars_cols       = write_dataset(dodsaars_dataset, args.grund_data_dir, f"dodsaars{year}")
-    dodsaasg_cols       = write_dataset(dodsaasg_dataset, args.grund_data_dir, f"dodsaasg{year}")
-    faik_cols           = write_dataset(faik_dataset, args.grund_data_dir, f"faik{year}")
-    udda_cols           = write_dataset(udda_dataset, args.grund_data_dir, f"udda{year}")
-    ras_cols            = write_dataset(ras_dataset, args.grund_data_dir, f"ras{year}")
-    akm_cols            = write_dataset(akm_dataset, args.grund_data_dir, f"akm{year}")
-    lpr2_adm_cols       = write_dataset(lpr2_adm_dataset, args.grund_data_dir, f"lpr_adm{year}")
-    lpr2_diag_cols      = write_dataset(lpr2_diag_dataset, args.grund_data_dir, f"lpr_diag{year}")
-    lpr3_kontakter_cols = write_dataset(lpr3_kontakter_dataset, args.grund_data_dir, f"lpr_f_kontakter{year}")
-    lpr3_diagnoser_cols = write_dataset(lpr3_diagnoser_dataset, args.grund_data_dir, f"lpr_f_diagnoser{year}")
-    psyk_adm_cols       = write_dataset(psyk_adm_dataset, args.grund_data_dir, f"psyk_adm{year}")
-    psyk_diag_cols      = write_dataset(psyk_diag_dataset, args.grund_data_dir, f"psyk_diag{year}")
-
-  # These datasets are not divided by year
-  pcr_patient_icd8_dataset = fake_pcr_patient_icd8_dataset(fake, bef_dataset)
-  pcr_patient_icd8_cols    = write_dataset(pcr_patient_icd8_dataset, args.external_data_dir, f"patient_icd8")
-
-  pcr_patient_icd10_dataset = fake_pcr_patient_icd10_dataset(fake, bef_dataset)
-  pcr_patient_icd10_cols    = write_dataset(pcr_patient_icd10_dataset, args.external_data_dir, f"patient_icd10")
-
-  pcr_diag_icd10_dataset = fake_pcr_diag_icd10_dataset(fake, pcr_patient_icd10_dataset)
-  pcr_diag_icd10_cols    = write_dataset(pcr_diag_icd10_dataset, args.external_data_dir, f"diag_icd10")
+def covered_groups(profile, year):
+  """
+  Returns the yearly dataset groups that exist in the given year of a profile.
+  """
+  groups = []
+
+  for group in YEARLY_GROUPS:
+    (first_year, last_year) = profile["coverage"].get(group, (None, None))
+
+    if (first_year is None or year >= first_year) and (last_year is None or year <= last_year):
+      groups.append(group)
+
+  return groups
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+  profile = PROFILES[args.profile]
+
+  if args.random_seed is None:
+    args.random_seed = secrets.randbits(32)
+
+  if args.bef_families_count is None:
+    args.bef_families_count = max(1, round(profile["families"] * args.scale_factor))
+
+  if args.chunk_size is None:
+    args.chunk_size = profile["chunk_size"]
+
+  logger.info(f"Generating {args.bef_families_count} families per year of the {args.profile} profile with the {args.engine} engine and random seed {args.random_seed}, {args.chunk_size} families at a time")
+
+  # The datasets that are not divided by year are derived from the last year
+  years = profile["years"]
+  tasks = [
+    (year, covered_groups(profile, year) + (EXTERNAL_GROUPS if year == years[-1] else [])) for year in years
+  ]
+
+  # The family pool is generated once and stored, since the BEF chunks of every
+  # year and dataset group are taken from it
+  pool_families_count = (len(years) - 1) * family_turnover(args) + args.bef_families_count
+  pool_chunks_count   = math.ceil(pool_families_count / args.chunk_size)
+
+  logger.info(f"Generating a pool of {pool_families_count} families")
+
+  with tempfile.TemporaryDirectory(prefix=f".{SCRIPT_NAME}-", dir=args.grund_data_dir) as pool_directory:
+    if args.workers > 1:
+      tasks = [(year, [group]) for (year, groups) in tasks for group in groups]
+
+      logger.info(f"Running {len(tasks)} tasks using {args.workers} worker processes")
+
+      with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for future in [executor.submit(write_pool_chunk, args, pool_directory, chunk_index) for chunk_index in range(pool_chunks_count)]:
+          future.result()
+
+        futures = [executor.submit(generate_groups, args, pool_directory, year, groups) for (year, groups) in tasks]
+        results = [future.result() for future in futures]
+    else:
+      for chunk_index in range(pool_chunks_count):
+        write_pool_chunk(args, pool_directory, chunk_index)
+
+      results = [generate_groups(args, pool_directory, year, groups) for (year, groups) in tasks]
+
+  dataset_cols = {}
+  manifest     = []
+
+  for (result_cols, result_manifest) in results:
+    dataset_cols.update(result_cols)
+    manifest += result_manifest
+
+  write_sas7bdat(manifest, args.workers)
 
   logger.info(f"Updating stage1 of metadata file {args.metadata_file}")
 
   with open(args.metadata_file, "r") as f:
     metadata = json.loads(f.read())
 
-  metadata["stage1"] = OrderedDict({
-    "bef": OrderedDict({
-      "columns": bef_cols
-    }),
-    "lmdb": OrderedDict({
-      "columns": lmdb_cols
-    }),
-    "ind": OrderedDict({
-      "columns": ind_cols
-    }),
-    "dodsaars": OrderedDict({
-      "columns": dodsaars_cols
-    }),
-    "dodsaasg": OrderedDict({
-      "columns": dodsaasg_cols
-    }),
-    "faik": OrderedDict({
-      "columns": faik_cols
-    }),
-    "udda": OrderedDict({
-      "columns": udda_cols
-    }),
-    "ras": OrderedDict({
-      "columns": ras_cols
-    }),
-    "akm": OrderedDict({
-      "columns": akm_cols
-    }),
-    "lpr_adm": OrderedDict({
-      "columns": lpr2_adm_cols
-    }),
-    "lpr_diag": OrderedDict({
-      "columns": lpr2_diag_cols
-    }),
-    "psyk_adm": OrderedDict({
-      "columns": psyk_adm_cols
-    }),
-    "psyk_diag": OrderedDict({
-      "columns": psyk_diag_cols
-    }),
-    "lpr_f_kontakter": OrderedDict({
-      "columns": lpr3_kontakter_cols
-    }),
-    "lpr_f_diagnoser": OrderedDict({
-      "columns": lpr3_diagnoser_cols
-    }),
-    "patient_icd8": OrderedDict({
-      "columns": pcr_patient_icd8_cols
-    }),
-    "patient_icd10": OrderedDict({
-      "columns": pcr_patient_icd10_cols
-    }),
-    "diag_icd10": OrderedDict({
-      "columns": pcr_diag_icd10_cols
-    })
-  })
+  metadata["stage1"] = OrderedDict([
+    (key, OrderedDict({ "columns": dataset_cols[key] })) for key in STAGE1_DATASETS
+  ])
 
   with open(args.metadata_file, "w") as f:
     f.write(json.dumps(metadata, indent=2))
@@ -738,11 +1620,46 @@ if __name__ == "__main__":
     help="Controls the log level, 'info' is default"
   )
 
+  parser.add_argument(
+    "--profile",
+    type=str,
+    default="small",
+    choices=list(PROFILES.keys()),
+    help="Controls the size, years and distributions of the generated datasets, 'small' is default and the only profile supported by the 'faker' engine"
+  )
+
+  parser.add_argument(
+    "--scale_factor",
+    type=float,
+    default=1.0,
+    help="Multiplies the amount of families of the profile, keeping the ratios between datasets"
+  )
+
   parser.add_argument(
     "--bef_families_count",
     type=int,
-    default=10,
-    help="Controls how many families to generate in the BEF dataset"
+    help="Controls how many families to generate in the BEF dataset, overrides the profile and scale factor"
+  )
+
+  parser.add_argument(
+    "--chunk_size",
+    type=int,
+    help="Controls how many families are generated and written at a time, which bounds the memory usage, defaults to the one of the profile"
+  )
+
+  parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Controls how many processes to generate the datasets with, the output is the same for any amount of workers"
+  )
+
+  parser.add_argument(
+    "--engine",
+    type=str,
+    default="faker",
+    choices=["faker", "numpy"],
+    help="Controls how rows are generated, 'faker' builds one dict per row and 'numpy' builds whole columns at a time"
   )
 
   parser.add_argument(
@@ -771,6 +1688,12 @@ if __name__ == "__main__":
 
   args = parser.parse_args()
 
+  if args.engine == "faker" and args.profile != "small":
+    parser.error(f"the {args.profile} profile requires --engine numpy")
+
+  if args.scale_factor <= 0:
+    parser.error("--scale_factor must be positive")
+
   if args.log_level == "debug":
     stream_handler.setLevel(logging.DEBUG)
   elif args.log_level == "error":
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
 import json
 import logging
 import os
@@ -18,6 +19,9 @@ SCRIPT_PATH = os.path.realpath(__file__)
 SCRIPT_DIR  = os.path.dirname(SCRIPT_PATH)
 PROJECT_DIR = os.path.dirname(SCRIPT_DIR)
 
+# Hashes of the PlantUML sources of the rendered diagrams, next to the diagrams
+DIAGRAMS_CACHE_NAME = ".diagrams.json"
+
 #-------------------------------------------------------------------------------
 # Logger setup
 
@@ -141,17 +145,62 @@ def dataset_to_org_document(key, name, dataset):
 
   return results
 
-def generate_plantuml_diagram(plantuml, out_path):
-  with open(out_path, "wb") as f:
+def plantuml_hash(plantuml):
+  return hashlib.sha256(plantuml.encode("utf-8")).hexdigest()
+
+def read_diagrams_cache(images_dir):
+  cache_path = os.path.join(images_dir, DIAGRAMS_CACHE_NAME)
+
+  if not os.path.isfile(cache_path):
+    return {}
+
+  with open(cache_path, "r") as f:
+    return json.loads(f.read())
+
+def write_diagrams_cache(images_dir, cache):
+  cache_path = os.path.join(images_dir, DIAGRAMS_CACHE_NAME)
+
+  with open(cache_path, "w") as f:
+    f.write(json.dumps(cache, indent=2, sort_keys=True))
+
+def generate_plantuml_diagrams(diagrams, images_dir, threads):
+  """
+  Renders the PlantUML sources of the diagrams, a dict of diagram name to
+  source, into PNG files named after the diagrams. All diagrams are rendered
+  by a single plantuml process, since starting its JVM takes longer than
+  rendering a diagram, which renders them with the given amount of threads.
+  """
+  with tempfile.TemporaryDirectory(prefix=f"{SCRIPT_NAME}-") as tmp_dir:
+    source_paths = []
+
+    for name, plantuml in diagrams.items():
+      source_path = os.path.join(tmp_dir, f"{name}.puml")
+
+      with open(source_path, "w") as f:
+        f.write(plantuml)
+
+      source_paths.append(source_path)
+
     proc = subprocess.run(
-      ["plantuml", "--pipe", "--format", "png"],
-      input=plantuml.encode("utf-8"),
-      stdout=subprocess.PIPE
+      ["plantuml", "-tpng", "-nbthread", str(threads), "-o", os.path.abspath(images_dir)] + source_paths
     )
 
     assert proc.returncode == 0
 
-    f.write(proc.stdout)
+def write_if_changed(path, content):
+  """
+  Writes the content to the file unless it already has that content, so the
+  modification time of unchanged files is kept. Returns whether it was written.
+  """
+  if os.path.isfile(path):
+    with open(path, "r") as f:
+      if f.read() == content:
+        return False
+
+  with open(path, "w") as f:
+    f.write(content)
+
+  return True
 
 def main(args):
   logger.info("Looking for metadata files in %s", args.metadata_dir)
@@ -160,28 +209,49 @@ def main(args):
 
   os.chdir(PROJECT_DIR)
 
-  out_dir   = "./docs/datasets"
-  doc_paths = {}
+  out_dir    = "./docs/datasets"
+  images_dir = os.path.join(out_dir, "images")
+  doc_paths  = {}
+  diagrams   = {}
+
+  if not os.path.exists(images_dir):
+    os.makedirs(images_dir)
 
-  if not os.path.exists(out_dir):
-    os.makedirs(os.path.join(out_dir, "images"))
+  cache = {} if args.force else read_diagrams_cache(images_dir)
 
   for key, dataset in metadata.items():
     name         = key.replace("_", " ")
     name         = name[0].upper() + name[1:]
     doc_path     = os.path.join(out_dir, f"{key}.org")
-    diagram_path = os.path.join(out_dir, "images", f"{key}_column_diagram.png")
+    diagram_name = f"{key}_column_diagram"
+    diagram_path = os.path.join(images_dir, f"{diagram_name}.png")
 
     doc      = dataset_to_org_document(key, name, dataset)
     plantuml = dataset_to_plantuml(key, name, dataset)
 
-    generate_plantuml_diagram(plantuml, diagram_path)
+    # Diagrams are only rendered again when their PlantUML source has changed
+    if cache.get(diagram_name) != plantuml_hash(plantuml) or not os.path.isfile(diagram_path):
+      diagrams[diagram_name] = plantuml
+    else:
+      logger.debug("Skipping diagram %s, its source is unchanged", diagram_name)
 
-    with open(doc_path, "w") as f:
-      f.write(doc)
+    if not write_if_changed(doc_path, doc):
+      logger.debug("Skipping org file %s, its content is unchanged", doc_path)
 
     doc_paths[name] = doc_path
 
+  if diagrams:
+    logger.info("Rendering %d of %d diagrams using %d threads", len(diagrams), len(metadata), args.threads)
+
+    generate_plantuml_diagrams(diagrams, images_dir, args.threads)
+
+    for diagram_name, plantuml in diagrams.items():
+      cache[diagram_name] = plantuml_hash(plantuml)
+
+    write_diagrams_cache(images_dir, cache)
+  else:
+    logger.info("All %d diagrams are up to date", len(metadata))
+
   logger.info("All org files created, here's a markdown link list to put in the README:")
 
   for key, doc_path in doc_paths.items():
@@ -205,6 +275,19 @@ if __name__ == "__main__":
     help="Path to directory that contains the metadata files"
   )
 
+  parser.add_argument(
+    "--threads",
+    type=int,
+    default=os.cpu_count(),
+    help="Amount of diagrams to render at the same time, the amount of CPUs is default"
+  )
+
+  parser.add_argument(
+    "--force",
+    action="store_true",
+    help="Renders every diagram, including diagrams whose PlantUML source is unchanged"
+  )
+
   args = parser.parse_args()
 
   if args.log_level == "debug":
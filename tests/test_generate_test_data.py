@@ -0,0 +1,73 @@
+import argparse
+import importlib.util
+import io
+import os
+
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+spec = importlib.util.spec_from_file_location(
+  "generate_test_data",
+  os.path.join(PROJECT_DIR, "scripts", "generate-test-data.py")
+)
+
+generate_test_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generate_test_data)
+
+def test_columnar_to_bytes_renders_empty_columns():
+  columns = [
+    np.array([], dtype="U5"),
+    np.array([], dtype=object),
+    np.array([], dtype=np.int64),
+    np.array([], dtype="datetime64[D]"),
+    np.ma.masked_array(np.array([], dtype=float))
+  ]
+
+  for column in columns:
+    assert generate_test_data.columnar_to_bytes(column).shape[0] == 0
+
+def test_write_columns_writes_only_the_header_of_an_empty_chunk():
+  f = io.StringIO()
+
+  cols = generate_test_data.write_columns(f, {
+    "PNR": np.array([], dtype="U10"),
+    "INDDTO": np.array([], dtype="datetime64[D]")
+  }, None)
+
+  assert cols == ["PNR", "INDDTO"]
+  assert f.getvalue() == "PNR,INDDTO\n"
+
+def test_write_columns_skips_empty_chunks_between_rows():
+  f    = io.StringIO()
+  cols = None
+
+  for values in [["a", "b"], [], ["c"]]:
+    cols = generate_test_data.write_columns(f, {
+      "PNR": np.array(values, dtype="U1"),
+      "N": np.arange(len(values), dtype=np.int64)
+    }, cols)
+
+  assert f.getvalue() == "PNR,N\na,0\nb,1\nc,0\n"
+
+def test_bef_years_share_persons_with_unique_ids(tmp_path):
+  args = argparse.Namespace(engine="numpy", random_seed=1, chunk_size=4)
+  pnrs = []
+
+  for chunk_index in range(4):
+    generate_test_data.write_pool_chunk(args, tmp_path, chunk_index)
+
+  for first_family in [0, 3]:
+    pool_chunks = {}
+    bef_chunks  = [generate_test_data.pool_families(args, tmp_path, pool_chunks, first_family + start, min(4, 10 - start)) for start in range(0, 10, 4)]
+    bef_dataset = generate_test_data.columnar_bef_rows(bef_chunks, 0, 10)
+
+    assert len(np.unique(bef_dataset["PNR"])) == 30
+    assert len(np.unique(bef_dataset["FAMILIE_ID"])) == 10
+
+    pnrs.append(dict(zip(bef_dataset["PNR"], bef_dataset["FOED_DAG"])))
+
+  shared = pnrs[0].keys() & pnrs[1].keys()
+
+  assert len(shared) == 21
+  assert all(pnrs[0][pnr] == pnrs[1][pnr] for pnr in shared)
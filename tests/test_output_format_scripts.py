@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR     = os.path.join(PROJECT_DIR, "modules", "output_format", "bin")
+
+sys.path.insert(0, os.path.join(PROJECT_DIR, "scripts"))
+
+import dst_datasets
+
+def test_compress_csv_writes_frames_of_whole_lines(tmp_path):
+  dataset_path = tmp_path / "population.csv"
+  index_path   = tmp_path / "population_index.csv"
+  content      = "person_id,source_file\n" + "".join(f"{person_id:04d},\"bef, {person_id}\"\n" for person_id in range(1000))
+
+  with open(dataset_path, "w", newline="") as f:
+    f.write(content)
+
+  subprocess.run(["bash", os.path.join(PROJECT_DIR, "modules", "stage2", "bin", "index-dataset.sh"), dataset_path, "person_id", index_path], check=True, capture_output=True)
+  subprocess.run(["bash", os.path.join(BIN_DIR, "compress-csv.sh"), dataset_path, "4096", "4"], check=True, capture_output=True)
+
+  assert not dataset_path.exists()
+
+  decompressed = subprocess.run(["zstd", "--decompress", "--stdout", "--quiet", f"{dataset_path}.zst"], check=True, capture_output=True).stdout
+
+  assert decompressed.decode() == content
+
+  with open(tmp_path / "population_frames.csv", "r", newline="") as f:
+    frames = [[int(field) for field in row] for row in list(csv.reader(f))[1:]]
+
+  assert len(frames) > 1
+  assert all(frame[1] <= 4096 for frame in frames)
+  assert sum(frame[1] for frame in frames) == len(content)
+
+  for (previous, frame) in zip(frames, frames[1:]):
+    assert frame[0] == previous[0] + previous[1]
+    assert frame[2] == previous[2] + previous[3]
+
+  assert dst_datasets.lookup(f"{dataset_path}.zst", ["0999", "0500"]) == [
+    { "person_id": "0500", "source_file": "bef, 500" },
+    { "person_id": "0999", "source_file": "bef, 999" }
+  ]
+
+def test_compress_csv_frames_decompress_on_their_own(tmp_path):
+  dataset_path = tmp_path / "population.csv"
+  content      = "person_id,source_file\n" + "".join(f"{person_id:05d},bef{person_id % 7}\n" for person_id in range(5000))
+
+  with open(dataset_path, "w", newline="") as f:
+    f.write(content)
+
+  subprocess.run(["bash", os.path.join(BIN_DIR, "compress-csv.sh"), dataset_path, "8192", "4"], check=True, capture_output=True)
+
+  with open(tmp_path / "population_frames.csv", "r", newline="") as f:
+    frames = [[int(field) for field in row] for row in list(csv.reader(f))[1:]]
+
+  (offset, length, compressed_offset, compressed_length) = frames[len(frames) // 2]
+
+  with open(f"{dataset_path}.zst", "rb") as f:
+    f.seek(compressed_offset)
+    frame = f.read(compressed_length)
+
+  decompressed = subprocess.run(["zstd", "--decompress", "--stdout", "--quiet"], input=frame, check=True, capture_output=True).stdout
+
+  assert len(frames) > 4
+  assert decompressed.decode() == content[offset:offset + length]
+  assert decompressed.endswith(b"\n")
+
+def test_open_dataset_reads_parquet_files(tmp_path):
+  pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+  pyarrow         = pytest.importorskip("pyarrow")
+
+  metadata = {
+    "file_format": { "extension": "parquet", "type": "binary", "compression": "zstd", "typed": True },
+    "size": 3,
+    "columns": {
+      "person_id": { "index": 0, "type": "string" },
+      "tax_year": { "index": 1, "type": "integer" },
+      "tax_sum": { "index": 2, "type": "number" }
+    }
+  }
+
+  with open(tmp_path / "income_metadata.json", "w") as f:
+    json.dump(metadata, f)
+
+  pyarrow_parquet.write_table(pyarrow.table({
+    "person_id": ["0001", "0002", None],
+    "tax_year": [2008, 2009, 2008],
+    "tax_sum": [10.5, None, 30.25]
+  }), tmp_path / "income.parquet")
+
+  income = dst_datasets.open_dataset(str(tmp_path / "income"))
+
+  assert list(income.iter_rows(columns=["person_id", "tax_sum"], filters=[("tax_year", "==", 2008)])) == [
+    { "person_id": "0001", "tax_sum": 10.5 },
+    { "person_id": None, "tax_sum": 30.25 }
+  ]
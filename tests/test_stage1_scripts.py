@@ -0,0 +1,72 @@
+import csv
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR     = os.path.join(PROJECT_DIR, "modules", "stage1", "bin")
+
+# The conversions are R scripts, which need R with the packages of the development shell
+pytestmark = pytest.mark.skipif(shutil.which("Rscript") is None, reason="Rscript is not installed")
+
+def read_rows(path):
+  with open(path, "r", newline="") as f:
+    return list(csv.reader(f))
+
+def write_sas7bdat(tmp_path, name, content):
+  csv_path      = tmp_path / f"{name}.csv"
+  sas7bdat_path = tmp_path / f"{name}.sas7bdat"
+  manifest_path = tmp_path / "manifest.json"
+
+  with open(csv_path, "w", newline="") as f:
+    f.write(content)
+
+  with open(manifest_path, "w") as f:
+    json.dump([{ "input": str(csv_path), "output": str(sas7bdat_path) }], f)
+
+  subprocess.run(["Rscript", os.path.join(PROJECT_DIR, "bin", "csv-to-sas7bdat.R"), manifest_path], check=True)
+
+  return sas7bdat_path
+
+def convert(input_path, columns, output_path, chunk_size, compression="none"):
+  subprocess.run(["Rscript", os.path.join(BIN_DIR, "sas7bdat-to-csv.R"), input_path, columns, output_path, str(chunk_size), compression, "1"], check=True)
+
+def test_sas7bdat_to_csv_converts_across_chunk_boundaries(tmp_path):
+  input_path = write_sas7bdat(tmp_path, "bef2008", (
+    "PNR,KOEN,FOED_DAG\n"
+    "A1,1,2001-01-01\n"
+    "A2,2,2002-02-02\n"
+    "A3,1,2003-03-03\n"
+    "A4,2,2004-04-04\n"
+    "A5,1,2005-05-05\n"
+  ))
+
+  whole_path   = tmp_path / "whole.csv"
+  chunked_path = tmp_path / "chunked.csv"
+
+  convert(input_path, "FOED_DAG,PNR,MISSING", whole_path, 0)
+  convert(input_path, "FOED_DAG,PNR,MISSING", chunked_path, 2)
+
+  rows = read_rows(chunked_path)
+
+  assert rows == read_rows(whole_path)
+  assert rows[0] == ["FOED_DAG", "PNR", "source_file"]
+  assert [row[1] for row in rows[1:]] == ["A1", "A2", "A3", "A4", "A5"]
+  assert {row[2] for row in rows[1:]} == {"bef2008.sas7bdat"}
+
+def test_sas7bdat_to_csv_compresses_chunks_while_they_are_written(tmp_path):
+  input_path = write_sas7bdat(tmp_path, "ind2008", "PNR,SKATTOT_13\nA1,10.5\nA2,20.25\nA3,30\n")
+
+  whole_path      = tmp_path / "whole.csv"
+  compressed_path = tmp_path / "compressed.csv.zst"
+
+  convert(input_path, "PNR,SKATTOT_13", whole_path, 0)
+  convert(input_path, "PNR,SKATTOT_13", compressed_path, 2, "zstd")
+
+  decompressed = subprocess.run(["zstd", "--decompress", "--stdout", "--quiet", compressed_path], check=True, capture_output=True).stdout
+
+  with open(whole_path, "rb") as f:
+    assert decompressed == f.read()
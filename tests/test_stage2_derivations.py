@@ -0,0 +1,68 @@
+import csv
+import datetime
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR     = os.path.join(PROJECT_DIR, "modules", "stage2", "bin")
+
+spec = importlib.util.spec_from_file_location(
+  "generate_test_data",
+  os.path.join(PROJECT_DIR, "scripts", "generate-test-data.py")
+)
+
+generate_test_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generate_test_data)
+
+# The derivations are R scripts, which need R with the packages of the development shell
+pytestmark = pytest.mark.skipif(shutil.which("Rscript") is None, reason="Rscript is not installed")
+
+def write_stage1_file(path, dataset, source_file):
+  """
+  Writes a generated dataset like stage 1 converts it, with the name of its
+  sas7bdat file in the last column.
+  """
+  dataset["source_file"] = np.full(len(next(iter(dataset.values()))), source_file)
+
+  with open(path, "w") as f:
+    generate_test_data.write_columns(f, dataset, None)
+
+def read_rows(path):
+  with open(path, "r", newline="") as f:
+    return list(csv.DictReader(f))
+
+def derive(script_name, output_prefix, typed, *input_paths):
+  subprocess.run(["Rscript", os.path.join(BIN_DIR, script_name), output_prefix, typed, *map(str, input_paths)], check=True)
+
+@pytest.mark.parametrize("script_name,dataset_name,column", [
+  ("derive-income-dataset.R", "ind", "SKATTOT_13"),
+  ("derive-family-income-dataset.R", "faik", "FAMSKATTOT_13")
+])
+def test_typed_derivations_keep_fractional_tax_sums(tmp_path, script_name, dataset_name, column):
+  rng         = np.random.default_rng(1)
+  bef_dataset = generate_test_data.columnar_bef_dataset(rng, 100)
+  period_date = datetime.datetime(2008, 12, 31, 23, 59, 59)
+  dataset     = getattr(generate_test_data, f"columnar_{dataset_name}_dataset")(rng, bef_dataset, period_date)
+  tax_sums    = dataset[column]
+  input_path  = tmp_path / f"{dataset_name}2008.csv"
+
+  assert (tax_sums != np.trunc(tax_sums)).any()
+
+  write_stage1_file(input_path, dataset, f"{dataset_name}2008.sas7bdat")
+  derive(script_name, tmp_path / "output", "true", input_path)
+
+  rows = read_rows(tmp_path / "output.csv")
+
+  with open(tmp_path / "output_metadata.json", "r") as f:
+    metadata = json.load(f)
+
+  assert metadata["columns"]["tax_sum"]["type"] == "number"
+  assert len(rows) == len(tax_sums)
+  assert [float(row["tax_sum"]) for row in rows] == pytest.approx(list(tax_sums))
+  assert {row["tax_year"] for row in rows} == {"2008"}
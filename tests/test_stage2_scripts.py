@@ -0,0 +1,130 @@
+import csv
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR     = os.path.join(PROJECT_DIR, "modules", "stage2", "bin")
+
+sys.path.insert(0, os.path.join(PROJECT_DIR, "scripts"))
+
+import dst_datasets
+
+def write_file(path, content):
+  with open(path, "w", newline="") as f:
+    f.write(content)
+
+def read_rows(path):
+  with open(path, "r", newline="") as f:
+    return list(csv.reader(f))
+
+def run_script(script_name, *args):
+  subprocess.run(["bash", os.path.join(BIN_DIR, script_name), *map(str, args)], check=True, capture_output=True)
+
+def test_sort_dataset_sorts_rows_with_quoted_values(tmp_path):
+  dataset_path = tmp_path / "dataset.csv"
+
+  write_file(dataset_path, (
+    "note,person_id,record_id\n"
+    "\"a, b\",3,1\n"
+    "\"multi\nline\",1,2\n"
+    "plain,2,1\n"
+    "\"\"\"quoted\"\"\",1,1\n"
+  ))
+
+  run_script("sort-dataset.sh", dataset_path, "person_id,record_id", "1M", 1)
+
+  assert read_rows(dataset_path) == [
+    ["note", "person_id", "record_id"],
+    ["\"quoted\"", "1", "1"],
+    ["multi\nline", "1", "2"],
+    ["plain", "2", "1"],
+    ["a, b", "3", "1"]
+  ]
+
+def test_sort_dataset_fails_on_unclosed_quoted_values(tmp_path):
+  dataset_path = tmp_path / "dataset.csv"
+
+  write_file(dataset_path, "person_id,note\n2,\"never closed\n1,x\n")
+
+  result = subprocess.run(["bash", os.path.join(BIN_DIR, "sort-dataset.sh"), dataset_path, "person_id", "1M", "1"], capture_output=True)
+
+  assert result.returncode != 0
+
+def test_index_dataset_keeps_keys_that_only_differ_by_leading_zeros(tmp_path):
+  dataset_path = tmp_path / "population.csv"
+  index_path   = tmp_path / "population_index.csv"
+
+  write_file(dataset_path, (
+    "person_id,source_file\n"
+    "0012,a\n"
+    "0012,b\n"
+    "012,\"c\nd\"\n"
+    "12,e\n"
+    "13,f\n"
+  ))
+
+  run_script("index-dataset.sh", dataset_path, "person_id", index_path)
+
+  assert read_rows(index_path) == [
+    ["person_id", "offset", "length", "rows"],
+    ["0012", "22", "14", "2"],
+    ["012", "36", "10", "1"],
+    ["12", "46", "5", "1"],
+    ["13", "51", "5", "1"]
+  ]
+
+  assert dst_datasets.lookup(str(dataset_path), ["12", "012"]) == [
+    { "person_id": "012", "source_file": "c\nd" },
+    { "person_id": "12", "source_file": "e" }
+  ]
+
+def test_partition_dataset_partitions_rows_with_quoted_values(tmp_path):
+  dataset_path  = tmp_path / "education.csv"
+  output_dir    = tmp_path / "education"
+  manifest_path = tmp_path / "education_partitions.csv"
+
+  write_file(dataset_path, (
+    "note,completed_at\n"
+    "\"a, b\",2008-06-30\n"
+    "\"multi\nline\",2009-01-31\n"
+    "plain,2008-12-31\n"
+    "\"empty\",\n"
+  ))
+
+  run_script("partition-dataset.sh", dataset_path, "completed_at", "completed_year", 4, output_dir, manifest_path)
+
+  assert read_rows(manifest_path) == [["2008", "2"], ["2009", "1"], ["__HIVE_DEFAULT_PARTITION__", "1"]]
+
+  assert read_rows(output_dir / "completed_year=2008" / "education.csv") == [
+    ["note", "completed_at"],
+    ["a, b", "2008-06-30"],
+    ["plain", "2008-12-31"]
+  ]
+
+  assert read_rows(output_dir / "completed_year=2009" / "education.csv") == [
+    ["note", "completed_at"],
+    ["multi\nline", "2009-01-31"]
+  ]
+
+def test_select_columns_keeps_quoted_values_whole(tmp_path):
+  input_path  = tmp_path / "dodsaars2001.csv"
+  output_path = tmp_path / "deaths.csv"
+
+  write_file(input_path, (
+    "C_DOD1,PNR,D_DODSDTO,source_file\n"
+    "\"I7\"\"09\",0012,2001-01-01,dodsaars2001.sas7bdat\n"
+    "\"multi\nline, cause\",0013,2002-02-02,dodsaars2001.sas7bdat\n"
+    "\n"
+    ",0014,2003-03-03,dodsaars2001.sas7bdat\n"
+  ))
+
+  subprocess.run(["zstd", "--quiet", input_path, "-o", f"{input_path}.zst"], check=True)
+
+  run_script("select-columns.sh", f"{input_path}.zst", "PNR,D_DODSDTO,C_DOD1", "dodsaars2001.csv", output_path)
+
+  assert read_rows(output_path) == [
+    ["0012", "2001-01-01", "I7\"09", "dodsaars2001.csv"],
+    ["0013", "2002-02-02", "multi\nline, cause", "dodsaars2001.csv"],
+    ["0014", "2003-03-03", "", "dodsaars2001.csv"]
+  ]